@@ -1,39 +1,98 @@
 import discord
 from redbot.core.bot import Red
-from redbot.core import checks, commands, Config
+from redbot.core import checks, commands, data_manager, Config
 from redbot.core.i18n import cog_i18n, Translator
 from redbot.core.utils._internal_utils import send_to_owners_with_prefix_replaced
-from redbot.core.utils.chat_formatting import escape, pagify
-
+from redbot.core.utils.chat_formatting import box, escape, humanize_number, pagify
+
+from .thetacache import MetadataCache
+from .thetaclient import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_OPEN,
+    CIRCUIT_STATES,
+    CircuitBreaker,
+    ThetaClient,
+)
+from .thetadispatch import AlertDispatcher
+from .thetaindex import ThetaIndex
+from .thetametrics import MetricsServer, ThetaMetrics
+from .thetascheduler import ThetaScheduler
+from .thetashard import ShardCoordinator, rendezvous_owner
+from .thetatoken import ThetaTokenManager
+from .thetatrace import CycleTrace, ThetaTracer, trace_phase
+from .thetawebhook import EVENT_ONLINE, WEBHOOK_PATH, WebhookReceiver
+from .thetaworker import PollWorker, StreamJob, StreamOutcome
 from .thetatypes import (
-    ThetaStream
+    ThetaStatusBatcher,
+    ThetaStream,
+    get_headers,
 )
 from .thetaerrors import (
     APIError,
     InvalidThetaCredentials,
     OfflineStream,
+    PollWorkerError,
     StreamNotFound,
     StreamsError,
 )
 from . import thetatypes as _thetatypes
 
+import os
 import re
+import socket
+import hashlib
+import time
+import uuid
 import logging
 import asyncio
 import aiohttp
 import contextlib
-from datetime import datetime
-from collections import defaultdict
-from typing import Optional, List, Tuple, Union
+from collections import Counter, defaultdict
+from typing import Dict, Mapping, Optional, List, Set, Tuple, Union
 
 _ = Translator("Streams", __file__)
 log = logging.getLogger("red.core.cogs.Theta")
 
+# Connection pool tuning for the shared Theta API session.
+THETA_CONNECTION_LIMIT = 100
+THETA_CONNECTION_LIMIT_PER_HOST = 20
+THETA_DNS_CACHE_TTL = 300
+THETA_KEEPALIVE_TIMEOUT = 60
+THETA_REQUEST_TIMEOUT = 30
+
+# Upper bound on how long a single stream check may take within a poll cycle.
+THETA_POLL_TIMEOUT = 30
+
+# Custom Config group holding one record per tracked stream.
+THETA_STREAM_GROUP = "THETA_STREAM"
+# How long changed stream records are held back so that writes can be coalesced.
+THETA_SAVE_DELAY = 5
+
+# How long a resolved login -> user ID pair is trusted before asking the API again.
+THETA_ID_REVALIDATE_INTERVAL = 7 * 24 * 60 * 60
+
+# Fields a webhook event's stream entry needs to be used without asking the API.
+THETA_EVENT_FIELDS = ("user_id", "user_name", "game_id", "type", "title", "thumbnail_url")
+
 
 @cog_i18n(_)
 class Theta(commands.Cog):
 
-    global_defaults = {"refresh_timer": 200, "tokens": {}, "streams": []}
+    global_defaults = {
+        "refresh_timer": 200,
+        "poll_concurrency": 10,
+        "tokens": {},
+        "streams": [],
+        "theta": [],
+        "user_ids": {},
+        "metrics_port": 0,
+        "webhook_port": 0,
+        "sweep_timer": 1800,
+        "shard_directory": None,
+        "poll_worker": False,
+        # Changed whenever a command adds, removes or moves streams, see _save_theta_edits
+        "records_revision": None,
+    }
 
     guild_defaults = {
         "autodelete": False,
@@ -42,28 +101,69 @@ class Theta(commands.Cog):
         "live_message_mention": True,
         "live_message_nomention": False,
         "ignore_reruns": False,
+        "live_updates": False,
     }
 
     role_defaults = {"mention": False}
 
+    theta_defaults = {"type": None, "name": None, "id": None, "channels": [], "messages": []}
+
+    theta_uid_pattern = re.compile(r"^usr[0-9a-z]+$")
+
     def __init__(self, bot: Red):
         super().__init__()
         self.db: Config = Config.get_conf(self, 26262626)
-        self.ttv_bearer_cache: dict = {}
         self.db.register_global(**self.global_defaults)
         self.db.register_guild(**self.guild_defaults)
         self.db.register_role(**self.role_defaults)
+        self.db.init_custom(THETA_STREAM_GROUP, 1)
+        self.db.register_custom(THETA_STREAM_GROUP, **self.theta_defaults)
 
         self.bot: Red = bot
 
         self.theta: List[Theta] = []
+        self._theta_index: ThetaIndex = ThetaIndex(self._get_channel_guild_id)
+        self._scheduler: ThetaScheduler = ThetaScheduler(self.global_defaults["refresh_timer"])
         self.task: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._client: Optional[ThetaClient] = None
+        self._token_manager: ThetaTokenManager = ThetaTokenManager(self.get_theta_bearer_token)
+        self._breaker: CircuitBreaker = CircuitBreaker(on_change=self._on_breaker_change)
+        self._status_batcher: Optional[ThetaStatusBatcher] = None
+        self._metrics: ThetaMetrics = ThetaMetrics()
+        self._tracer: ThetaTracer = ThetaTracer()
+        self._metrics_server: MetricsServer = MetricsServer(self._render_metrics)
+        self._dispatcher: AlertDispatcher = AlertDispatcher(self._metrics)
+        self._metadata_cache: MetadataCache = MetadataCache()
+        # Cache statistics already added to the metrics, see _collect_metrics
+        self._cache_hits: Counter = Counter()
+        self._cache_misses: Counter = Counter()
+        self._theta_ids: Dict[str, dict] = {}
+        self._guild_settings: Dict[int, dict] = {}
+        self._mention_roles: Dict[int, Set[int]] = {}
+        self._dirty_theta: Set[ThetaStream] = set()
+        self._removed_records: Set[str] = set()
+        # Records this instance has seen in Config, and the revision they were read at
+        self._known_records: Set[str] = set()
+        self._records_revision: Optional[str] = None
+        # Logins whose entry in the user ID index changed since the last save
+        self._changed_theta_ids: Set[str] = set()
+        self._save_task: Optional[asyncio.Task] = None
+        # Serializes checks of the same stream coming from the poll loop and from webhooks
+        self._stream_locks: Dict[ThetaStream, asyncio.Lock] = {}
+        self._webhook: Optional[WebhookReceiver] = None
+        self._shard: Optional[ShardCoordinator] = None
+        self._shard_mismatch_logged = False
+        self._poll_worker: Optional[PollWorker] = None
+        # Streams that were live at their latest check
+        self._live_theta: Set[ThetaStream] = set()
+        self._poll_epoch: Optional[int] = None
 
         self._ready_event: asyncio.Event = asyncio.Event()
         self._init_task: asyncio.Task = self.bot.loop.create_task(self.initialize())
 
     def check_name_or_id(self, data: str) -> bool:
-        matched = self.yt_cid_pattern.fullmatch(data)
+        matched = self.theta_uid_pattern.fullmatch(data)
         if matched is None:
             return True
         return False
@@ -73,18 +173,78 @@ class Theta(commands.Cog):
         await self.bot.wait_until_ready()
 
         try:
-            await self.move_api_keys()
-            await self.get_theta_bearer_token()
-            self.theta = await self.load_theta()
-            self.task = self.bot.loop.create_task(self._theta_alerts())
+            self._session = self._create_session()
+            self._client = ThetaClient(
+                self._session,
+                token_manager=self._token_manager,
+                metrics=self._metrics,
+                breaker=self._breaker,
+            )
+            self._status_batcher = ThetaStatusBatcher(self._client)
+            await asyncio.gather(self.move_api_keys(), self._load_settings())
+            # Requests the bearer token in the background, checks made before it arrives
+            # fail like any other and the streams are checked again next time
+            self._token_manager.start()
+            webhook_port = await self.db.webhook_port()
+            if webhook_port:
+                # Already logged, polling at the refresh timer still keeps alerts working
+                with contextlib.suppress(OSError, InvalidThetaCredentials):
+                    await self._start_webhook(webhook_port)
+            await self._update_poll_interval()
+            self._set_theta(await self.load_theta())
+            shard_directory = await self.db.shard_directory()
+            if shard_directory:
+                # Already logged, polling everything beats polling nothing
+                with contextlib.suppress(OSError):
+                    await self._start_sharding(shard_directory)
+            if await self.db.poll_worker():
+                # Already logged, the cog polls by itself without its worker
+                with contextlib.suppress(OSError):
+                    self._start_poll_worker()
+            metrics_port = await self.db.metrics_port()
+            if metrics_port:
+                # Already logged, a busy port shouldn't stop the cog from working
+                with contextlib.suppress(OSError):
+                    await self._start_metrics_server(metrics_port)
         except Exception as error:
             log.exception("Failed to initialize Theta cog:", exc_info=error)
 
+        # Whatever failed above, polling the streams that could be loaded beats not polling
+        self.task = self.bot.loop.create_task(self._theta_alerts())
         self._ready_event.set()
 
+    async def _load_settings(self) -> None:
+        """Load the in-memory snapshots the poll loop reads instead of Config."""
+        self._theta_ids = await self.db.user_ids()
+        self._guild_settings = await self.db.all_guilds()
+        self._index_mention_roles(await self.db.all_roles())
+
+    @staticmethod
+    def _create_session() -> aiohttp.ClientSession:
+        """Create the long-lived session shared by every Theta API call."""
+        connector = aiohttp.TCPConnector(
+            limit=THETA_CONNECTION_LIMIT,
+            limit_per_host=THETA_CONNECTION_LIMIT_PER_HOST,
+            ttl_dns_cache=THETA_DNS_CACHE_TTL,
+            keepalive_timeout=THETA_KEEPALIVE_TIMEOUT,
+        )
+        return aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=THETA_REQUEST_TIMEOUT)
+        )
+
     async def cog_before_invoke(self, ctx: commands.Context):
         await self._ready_event.wait()
 
+    @commands.Cog.listener()
+    async def on_red_api_tokens_update(self, service_name: str, api_tokens: Mapping[str, str]):
+        """Request a bearer token with new credentials right away."""
+        if service_name != ThetaStream.token_name or self._client is None:
+            return
+        try:
+            await self._token_manager.refresh()
+        except Exception as error:
+            log.exception("Failed to request a Theta bearer token", exc_info=error)
+
     async def move_api_keys(self) -> None:
         """Move the API keys from cog stored config to core bot config if they exist."""
         tokens = await self.db.tokens()
@@ -95,7 +255,12 @@ class Theta(commands.Cog):
                 await self.bot.set_shared_api_tokens("theta", client_id=token)
         await self.db.tokens.clear()
 
-    async def get_theta_bearer_token(self) -> None:
+    async def get_theta_bearer_token(self) -> Optional[dict]:
+        """Request a new bearer token, returns the OAuth2 response or ``None`` on failure.
+
+        This is what `ThetaTokenManager` calls, use ``self._token_manager.refresh()``
+        so that concurrent renewals are combined.
+        """
         tokens = await self.bot.get_shared_api_tokens("theta")
         if tokens.get("client_id"):
             try:
@@ -113,59 +278,52 @@ class Theta(commands.Cog):
                     "or in DM with the bot."
                 )
                 await send_to_owners_with_prefix_replaced(self.bot, message)
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://api.theta.tv/v1",
-                params={
-                    "client_id": tokens.get("client_id", ""),
-                    "client_secret": tokens.get("client_secret", ""),
-                    "code": tokens.get("code_given", ""),
-                    "grant_type": "authorization_code",
-                },
-            ) as req:
-                try:
-                    data = await req.json()
-                except aiohttp.ContentTypeError:
-                    data = {}
-
-                if req.status == 200:
-                    pass
-                elif req.status == 400 and data.get("message") == "invalid client":
-                    log.error(
-                        "Theta API request failed authentication: set Client ID is invalid."
-                    )
-                elif req.status == 403 and data.get("message") == "invalid client secret":
-                    log.error(
-                        "Theta API request failed authentication: set Client Secret is invalid."
-                    )
-                elif "message" in data:
-                    log.error(
-                        "Theta OAuth2 API request failed with status code %s"
-                        " and error message: %s",
-                        req.status,
-                        data["message"],
-                    )
-                else:
-                    log.error("Theta OAuth2 API request failed with status code %s", req.status)
+        status, data = await self._client.request(
+            "POST",
+            "https://api.theta.tv/v1",
+            params={
+                "client_id": tokens.get("client_id", ""),
+                "client_secret": tokens.get("client_secret", ""),
+                "code": tokens.get("code_given", ""),
+                "grant_type": "authorization_code",
+            },
+        )
+        if not isinstance(data, dict):
+            data = {}
 
-                if req.status != 200:
-                    return
+        if status == 200:
+            pass
+        elif status == 400 and data.get("message") == "invalid client":
+            log.error("Theta API request failed authentication: set Client ID is invalid.")
+        elif status == 403 and data.get("message") == "invalid client secret":
+            log.error("Theta API request failed authentication: set Client Secret is invalid.")
+        elif "message" in data:
+            log.error(
+                "Theta OAuth2 API request failed with status code %s"
+                " and error message: %s",
+                status,
+                data["message"],
+            )
+        else:
+            log.error("Theta OAuth2 API request failed with status code %s", status)
 
-        self.ttv_bearer_cache = data
-        self.ttv_bearer_cache["expires_at"] = datetime.now().timestamp() + data.get("expires_in")
+        if status != 200:
+            return None
+        return data
 
     async def maybe_renew_theta_bearer_token(self) -> None:
-        if self.ttv_bearer_cache:
-            if self.ttv_bearer_cache["expires_at"] - datetime.now().timestamp() <= 60:
-                await self.get_theta_bearer_token()
+        await self._token_manager.ensure_fresh()
 
     @commands.command()
     async def thetastream(self, ctx: commands.Context, channel_name: str):
         """Check if a Theta channel is live."""
         await self.maybe_renew_theta_bearer_token()
         token = (await self.bot.get_shared_api_tokens("theta")).get("code_given")
-        theta = ThetaStream(
-            name=channel_name, token=token, bearer=self.ttv_bearer_cache.get("code_given", None),
+        theta = self._make_theta(
+            ThetaStream,
+            name=channel_name,
+            id=self._get_cached_theta_id(channel_name),
+            token=token,
         )
         await self.check_online(ctx, theta)
 
@@ -194,7 +352,7 @@ class Theta(commands.Cog):
         else:
             if isinstance(info, tuple):
                 embed, is_rerun = info
-                ignore_reruns = await self.db.guild(ctx.channel.guild).ignore_reruns()
+                ignore_reruns = self._get_guild_settings(ctx.channel.guild)["ignore_reruns"]
                 if ignore_reruns and is_rerun:
                     await ctx.send(_("That user is offline."))
                     return
@@ -240,33 +398,7 @@ class Theta(commands.Cog):
         Do `[p]thetaalert quit yes` to disable all stream alerts in
         this server.
         """
-        streams = self.theta.copy()
-        local_channel_ids = [c.id for c in ctx.guild.channels]
-        to_remove = []
-
-        for theta in theta:
-            for channel_id in theta.channels:
-                if channel_id == ctx.channel.id:
-                    theta.channels.remove(channel_id)
-                elif _all and ctx.channel.id in local_channel_ids:
-                    if channel_id in theta.channels:
-                        stream.channels.remove(channel_id)
-
-                        if not theta.channels:
-                            to_remove.append(stream)
-
-                            for theta in to_remove:
-                                theta.remove(stream)
-
-                                self.theta = theta
-                                await self.save_theta()
-
-                                if _all:
-                                    msg = _("All the stream alerts in this server have been disabled.")
-                                else:
-                                    msg = _("All the stream alerts in this channel have been disabled.")
-
-                                    await ctx.send(msg)
+        await self._disable_theta_alerts(ctx, _all)
 
     @thetaalert.command(name="stop", usage="[disable_all=No]")
     async def thetaalert_stop(self, ctx: commands.Context, _all: bool = False):
@@ -276,94 +408,94 @@ class Theta(commands.Cog):
         Do `[p]thetaalert stop yes` to disable all stream alerts in
         this server.
         """
-        theta = self.theta.copy()
-        local_channel_ids = [c.id for c in ctx.guild.channels]
-        to_remove = []
-
-        for theta in theta:
-            for channel_id in theta.channels:
-                if channel_id == ctx.channel.id:
-                    theta.channels.remove(channel_id)
-                elif _all and ctx.channel.id in local_channel_ids:
-                    if channel_id in theta.channels:
-                        theta.channels.remove(channel_id)
+        await self._disable_theta_alerts(ctx, _all)
 
-                        if not theta.channels:
-                            to_remove.append(theta)
+    async def _disable_theta_alerts(self, ctx: commands.Context, _all: bool):
+        if _all:
+            channel_ids = set(self._theta_index.guild_channels(ctx.guild.id))
+        else:
+            channel_ids = {ctx.channel.id}
 
-                            for theta in to_remove:
-                                theta.remove(stream)
+        emptied = set()
+        for channel_id in channel_ids:
+            for theta in list(self._theta_index.in_channel(channel_id)):
+                self._theta_index.remove_channel(theta, channel_id)
+                self._dirty_theta.add(theta)
+                if not theta.channels:
+                    emptied.add(theta)
 
-                                self.theta = theta
-                                await self.save_theta()
+        for theta in emptied:
+            self._remove_theta(theta)
+        await self._save_theta_edits()
 
-                                if _all:
-                                    msg = _("All the stream alerts in this server have been disabled.")
-                                else:
-                                    msg = _("All the stream alerts in this channel have been disabled.")
+        if _all:
+            msg = _("All the stream alerts in this server have been disabled.")
+        else:
+            msg = _("All the stream alerts in this channel have been disabled.")
 
-                                await ctx.send(msg)
+        await ctx.send(msg)
 
     @thetaalert.command(name="list")
     async def thetaalert_list(self, ctx: commands.Context):
         """List all active stream alerts in this server."""
-        theta_list = defaultdict(list)
-        guild_channels_ids = [c.id for c in ctx.guild.channels]
-        msg = _("Active alerts:\n\n")
-
-        for theta in self.theta:
-            for channel_id in theta.channels:
-                if channel_id in guild_channels_ids:
-                    theta_list[channel_id].append(theta.name.lower())
-
-                    if not theta_list:
-                        await ctx.send(_("There are no active alerts in this server."))
-                        return
+        channel_ids = self._theta_index.guild_channels(ctx.guild.id)
+        if not channel_ids:
+            await ctx.send(_("There are no active alerts in this server."))
+            return
 
-                    for channel_id, theta in theta_list.items():
-                        channel = ctx.guild.get_channel(channel_id)
-                        msg += "** - #{}**\n{}\n".format(channel, ", ".join(theta))
+        msg = _("Active alerts:\n\n")
+        for channel_id in channel_ids:
+            channel = ctx.guild.get_channel(channel_id)
+            theta_list = sorted(
+                (theta.name or theta.id).lower()
+                for theta in self._theta_index.in_channel(channel_id)
+            )
+            msg += "** - #{}**\n{}\n".format(channel, ", ".join(theta_list))
 
-                    for page in pagify(msg):
-                        await ctx.send(page)
+        for page in pagify(msg):
+            await ctx.send(page)
 
     async def theta_alert(self, ctx: commands.Context, _class, channel_name):
         theta = self.get_theta(_class, channel_name)
         if not theta:
             token = await self.bot.get_shared_api_tokens(_class.token_name)
-            is_theta = _class.__name__ == "ThetaStream"
-            if is_theta and not self.check_name_or_id(channel_name):
-                theta = _class(id=channel_name, token=token)
-            elif is_theta:
-                await self.maybe_renew_theta_bearer_token()
-                theta = _class(
+            await self.maybe_renew_theta_bearer_token()
+            theta = self._make_theta(
+                _class,
                 name=channel_name,
+                id=self._get_cached_theta_id(channel_name),
                 token=token.get("client_id"),
-                bearer=self.ttv_bearer_cache.get("code_given", None),
-                )
-            else:
-                theta = _class(name=channel_name, token=token)
-                try:
-                    exists = await self.check_exists(stream)
-                except InvalidThetaCredentials:
-                    await ctx.send(
+            )
+            try:
+                if not theta.id and not self.check_name_or_id(channel_name):
+                    # Logins can look like user IDs too, so it is only taken as an ID
+                    # when no user has it as their login
+                    try:
+                        theta.id = await theta.fetch_id()
+                    except StreamNotFound:
+                        theta = self._make_theta(
+                            _class, id=channel_name, token=token.get("client_id")
+                        )
+                exists = await self.check_exists(theta)
+            except InvalidThetaCredentials:
+                await ctx.send(
                     _(
-                    "The Thetatoken is either invalid or has not been set. See "
-                    "`{prefix}thetaset thetatoken`."
+                        "The Thetatoken is either invalid or has not been set. See "
+                        "`{prefix}thetaset thetatoken`."
                     ).format(prefix=ctx.clean_prefix)
-                    )
-                    return
-                except APIError:
-                    await ctx.send(
+                )
+                return
+            except APIError:
+                await ctx.send(
                     _("Something went wrong while trying to contact the stream service's API.")
-                    )
+                )
+                return
+            else:
+                if not exists:
+                    await ctx.send(_("That channel doesn't seem to exist."))
                     return
-                else:
-                    if not exists:
-                        await ctx.send(_("That channel doesn't seem to exist."))
-                        return
 
-                        await self.add_or_remove(ctx, stream)
+        await self.add_or_remove(ctx, theta)
 
     @commands.group()
     @checks.mod()
@@ -378,11 +510,442 @@ class Theta(commands.Cog):
         if refresh_time < 60:
             return await ctx.send(_("You cannot set the refresh timer to less than 60 seconds"))
 
-            await self.db.refresh_timer.set(refresh_time)
-            await ctx.send(
+        await self.db.refresh_timer.set(refresh_time)
+        await self._update_poll_interval()
+        await ctx.send(
             _("Refresh timer set to {refresh_time} seconds".format(refresh_time=refresh_time))
+        )
+
+    @thetaset.command(name="schedule")
+    @checks.is_owner()
+    async def _thetaset_schedule(self, ctx: commands.Context):
+        """Show when the tracked Theta streams will next be checked."""
+        schedule = self._scheduler.schedule()
+        if not schedule:
+            return await ctx.send(_("There are no Theta streams to check."))
+
+        intervals = Counter(int(interval) for theta, remaining, interval in schedule)
+        msg = _("Tracked streams: {count}\n\n").format(count=len(schedule))
+        msg += _("Streams by polling interval:\n")
+        for interval, count in sorted(intervals.items()):
+            msg += _("  every {interval}s: {count}\n").format(interval=interval, count=count)
+        msg += _("\nNext checks:\n")
+        for theta, remaining, interval in schedule[:15]:
+            msg += _("  {theta}: in {remaining}s (every {interval}s)\n").format(
+                theta=theta.name or theta.id, remaining=int(remaining), interval=int(interval)
             )
 
+        for page in pagify(msg):
+            await ctx.send(box(page))
+
+    @thetaset.command(name="memory")
+    @checks.is_owner()
+    async def _thetaset_memory(self, ctx: commands.Context):
+        """Show roughly how much memory the tracked Theta streams use."""
+        if not self.theta:
+            return await ctx.send(_("There are no Theta streams to check."))
+
+        total = sum(theta.footprint() for theta in self.theta)
+        alerts = sum(len(theta._messages_cache) for theta in self.theta)
+        msg = _(
+            "Tracked streams: {count}\n"
+            "Posted alerts: {alerts}\n"
+            "Total size: {total} bytes\n"
+            "Average per stream: {average} bytes"
+        ).format(
+            count=humanize_number(len(self.theta)),
+            alerts=humanize_number(alerts),
+            total=humanize_number(total),
+            average=humanize_number(total // len(self.theta)),
+        )
+        await ctx.send(box(msg))
+
+    @thetaset.command(name="concurrency")
+    @checks.is_owner()
+    async def _thetaset_poll_concurrency(self, ctx: commands.Context, limit: int):
+        """Set how many Theta streams are checked at the same time."""
+        if not 1 <= limit <= THETA_CONNECTION_LIMIT:
+            return await ctx.send(
+                _("The concurrency limit must be between 1 and {maximum}.").format(
+                    maximum=THETA_CONNECTION_LIMIT
+                )
+            )
+
+        await self.db.poll_concurrency.set(limit)
+        await ctx.send(
+            _("Up to {limit} Theta streams will now be checked at the same time.").format(
+                limit=limit
+            )
+        )
+
+    @thetaset.command(name="stats")
+    @checks.is_owner()
+    async def _thetaset_stats(self, ctx: commands.Context):
+        """Show poll, API and alert statistics since the cog was loaded."""
+        self._collect_metrics()
+        metrics = self._metrics
+        msg = ""
+        cycles = metrics.histogram("theta_poll_cycle_seconds")
+        if cycles is not None:
+            msg += _(
+                "Poll cycles: {count}, {mean:.2f}s on average, {p95:.2f}s at p95\n"
+                "Streams in the latest cycle: {streams}\n"
+            ).format(
+                count=humanize_number(cycles.count),
+                mean=cycles.mean,
+                p95=cycles.quantile(0.95),
+                streams=humanize_number(int(metrics.values["theta_poll_cycle_streams"][()])),
+            )
+        outcomes = metrics.values.get("theta_stream_checks_total", {})
+        if outcomes:
+            msg += _("Stream checks: {outcomes}\n").format(
+                outcomes=", ".join(
+                    "{} {}".format(dict(labels)["result"], humanize_number(int(count)))
+                    for labels, count in sorted(outcomes.items())
+                )
+            )
+        errors = metrics.values.get("theta_stream_check_errors_total", {})
+        if errors:
+            msg += _("Check errors: {errors}\n").format(
+                errors=", ".join(
+                    "{} {}".format(dict(labels)["error"], humanize_number(int(count)))
+                    for labels, count in sorted(errors.items())
+                )
+            )
+
+        statuses = defaultdict(list)
+        for labels, count in sorted(metrics.values.get("theta_api_requests_total", {}).items()):
+            labels = dict(labels)
+            statuses[labels["endpoint"]].append("{} x{}".format(labels["status"], int(count)))
+        if statuses:
+            msg += _("\nTheta API requests:\n")
+        for endpoint, counts in statuses.items():
+            latency = metrics.histogram("theta_api_request_seconds", endpoint=endpoint)
+            msg += _("  {endpoint}: {counts}, {mean:.3f}s avg, {p95:.3f}s p95\n").format(
+                endpoint=endpoint,
+                counts=", ".join(counts),
+                mean=latency.mean,
+                p95=latency.quantile(0.95),
+            )
+
+        hits = Counter()
+        for labels, count in metrics.values.get("theta_cache_hits_total", {}).items():
+            hits[dict(labels)["field"]] = int(count)
+        misses = Counter()
+        for labels, count in metrics.values.get("theta_cache_misses_total", {}).items():
+            misses[dict(labels)["field"]] = int(count)
+        lookups = sum(hits.values()) + sum(misses.values())
+        entries = metrics.values.get("theta_cache_entries", {}).get((), 0)
+        msg += _("\nMetadata cache: {entries} entries, {rate:.0%} hit rate\n").format(
+            entries=humanize_number(int(entries)),
+            rate=sum(hits.values()) / lookups if lookups else 0.0,
+        )
+        for field in sorted(set(hits) | set(misses)):
+            total = hits[field] + misses[field]
+            msg += _("  {field}: {rate:.0%} of {total}\n").format(
+                field=field, rate=hits[field] / total, total=humanize_number(total)
+            )
+
+        delivery = metrics.histogram("theta_alert_delivery_seconds")
+        if delivery is not None:
+            msg += _(
+                "\nAlerts delivered: {count}, {mean:.2f}s on average, {p95:.2f}s at p95\n"
+            ).format(
+                count=humanize_number(delivery.count),
+                mean=delivery.mean,
+                p95=delivery.quantile(0.95),
+            )
+        if self._poll_worker is not None:
+            circuit = self._poll_worker.breaker_state
+        else:
+            circuit = self._breaker.state
+        if circuit != CIRCUIT_CLOSED:
+            msg += _(
+                "\nTheta API circuit: {state}, streams are checked again once the API answers\n"
+            ).format(state=circuit)
+        if self._poll_worker is not None:
+            msg += _("\nPoll worker: {state}, restarted {restarts} times\n").format(
+                state=_("running as PID {pid}").format(pid=self._poll_worker.pid)
+                if self._poll_worker.running
+                else _("not running"),
+                restarts=self._poll_worker.restarts,
+            )
+        if self._metrics_server.port:
+            msg += _("\nPrometheus metrics: http://127.0.0.1:{port}/metrics\n").format(
+                port=self._metrics_server.port
+            )
+
+        for page in pagify(msg):
+            await ctx.send(box(page))
+
+    @thetaset.command(name="metricsport")
+    @checks.is_owner()
+    async def _thetaset_metrics_port(self, ctx: commands.Context, port: int):
+        """Serve Prometheus metrics on this local port, or `0` to stop serving them.
+
+        The endpoint only listens on 127.0.0.1.
+        """
+        if not 0 <= port <= 65535:
+            return await ctx.send(_("The port must be between 1 and 65535, or 0 to disable."))
+        if port == 0:
+            await self._metrics_server.close()
+            await self.db.metrics_port.set(0)
+            return await ctx.send(_("Prometheus metrics are no longer served."))
+        try:
+            await self._start_metrics_server(port)
+        except OSError as error:
+            return await ctx.send(
+                _("Could not listen on port {port}: {error}").format(port=port, error=error)
+            )
+        await self.db.metrics_port.set(port)
+        await ctx.send(
+            _("Prometheus metrics are now served at http://127.0.0.1:{port}/metrics").format(
+                port=port
+            )
+        )
+
+    @thetaset.command(name="worker")
+    @checks.is_owner()
+    async def _thetaset_poll_worker(self, ctx: commands.Context, on_off: bool):
+        """Poll streams from a separate process, keeping API traffic off the bot's event loop.
+
+        The worker process only reports the streams whose alerts have to be
+        sent, edited or deleted, the bot then just talks to Discord. Webhook
+        events and commands are still handled by the bot itself.
+        """
+        if not on_off:
+            await self._stop_poll_worker()
+            await self.db.poll_worker.set(False)
+            return await ctx.send(_("Theta streams are now polled by the bot itself."))
+        try:
+            self._start_poll_worker()
+        except OSError as error:
+            return await ctx.send(
+                _("Could not start the poll worker: {error}").format(error=error)
+            )
+        await self.db.poll_worker.set(True)
+        await ctx.send(_("Theta streams are now polled from a separate process."))
+
+    @thetaset.command(name="webhook")
+    @checks.is_owner()
+    async def _thetaset_webhook(self, ctx: commands.Context, port: int):
+        """Receive go-live and go-offline events on this local port, or `0` to stop.
+
+        Events must be signed with the `webhook_secret` of the `theta` API tokens.
+        While events are received, streams are only polled every sweep timer
+        seconds to catch up on missed events, see `[p]thetaset sweep`.
+        """
+        if not 0 <= port <= 65535:
+            return await ctx.send(_("The port must be between 1 and 65535, or 0 to disable."))
+        if port == 0:
+            if self._webhook is not None:
+                await self._webhook.close()
+            await self.db.webhook_port.set(0)
+            await self._update_poll_interval()
+            self._scheduler.rebuild(self.theta)
+            return await ctx.send(
+                _("Theta events are no longer received, streams are polled as usual.")
+            )
+        try:
+            await self._start_webhook(port)
+        except InvalidThetaCredentials:
+            return await ctx.send(
+                _(
+                    "Set a secret shared with the event sender first:\n"
+                    "`{prefix}set api theta webhook_secret <your_secret_here>`"
+                ).format(prefix=ctx.clean_prefix)
+            )
+        except OSError as error:
+            return await ctx.send(
+                _("Could not listen on port {port}: {error}").format(port=port, error=error)
+            )
+        await self.db.webhook_port.set(port)
+        await self._update_poll_interval()
+        self._scheduler.rebuild(self.theta)
+        await ctx.send(
+            _(
+                "Theta events are now received at http://127.0.0.1:{port}{path}, streams are "
+                "polled every {timer} seconds to catch up on missed events."
+            ).format(port=port, path=WEBHOOK_PATH, timer=self._scheduler.refresh_timer)
+        )
+
+    @thetaset.command(name="sweep")
+    @checks.is_owner()
+    async def _thetaset_sweep_timer(self, ctx: commands.Context, sweep_time: int):
+        """Set how often streams are polled while webhook events are received."""
+        if sweep_time < 300:
+            return await ctx.send(_("You cannot set the sweep timer to less than 300 seconds"))
+
+        await self.db.sweep_timer.set(sweep_time)
+        await self._update_poll_interval()
+        await ctx.send(_("Sweep timer set to {sweep_time} seconds").format(sweep_time=sweep_time))
+
+    @thetaset.group(name="shard")
+    @checks.is_owner()
+    async def _thetaset_shard(self, ctx: commands.Context):
+        """Split polling between bot instances sharing this cog's Config."""
+        pass
+
+    @_thetaset_shard.command(name="enable")
+    async def _thetaset_shard_enable(self, ctx: commands.Context, *, directory: str):
+        """Poll only this instance's share of the streams.
+
+        Every instance must use the same directory, on storage they all can
+        reach, and be in the same servers, as each stream is polled by a
+        single instance that must see all of its alert channels. Instances
+        write heartbeats there, and the streams of an instance that stops are
+        taken over by the others within a minute. Alerts added or removed on
+        one instance reach the others at their next heartbeat.
+        """
+        try:
+            await self._start_sharding(directory)
+        except OSError as error:
+            return await ctx.send(
+                _("Could not use {directory}: {error}").format(directory=directory, error=error)
+            )
+        mismatched = self._shard.mismatched()
+        if mismatched:
+            await self._stop_sharding()
+            return await ctx.send(
+                _(
+                    "Polling can't be shared with {instances}, they are not in the same "
+                    "servers as this instance."
+                ).format(instances=", ".join(mismatched))
+            )
+        await self.db.shard_directory.set(directory)
+        await ctx.invoke(self._thetaset_shard_status)
+
+    @_thetaset_shard.command(name="disable")
+    async def _thetaset_shard_disable(self, ctx: commands.Context):
+        """Poll every stream from this instance again."""
+        await self._stop_sharding()
+        await self.db.shard_directory.set(None)
+        await ctx.send(_("This instance now polls every Theta stream."))
+
+    @_thetaset_shard.command(name="status")
+    async def _thetaset_shard_status(self, ctx: commands.Context):
+        """Show the instances sharing the polling and this instance's share."""
+        if self._shard is None:
+            return await ctx.send(_("Polling isn't shared with other instances."))
+        owned = sum(1 for theta in self.theta if self._owns(theta))
+        msg = _(
+            "Directory: {directory}\n"
+            "This instance: {instance}\n"
+            "Instances: {members}\n"
+            "Streams polled here: {owned} of {total}"
+        ).format(
+            directory=self._shard.directory,
+            instance=self._shard.instance,
+            members=", ".join(sorted(self._shard.members)),
+            owned=humanize_number(owned),
+            total=humanize_number(len(self.theta)),
+        )
+        mismatched = self._shard.mismatched()
+        if mismatched:
+            msg += _("\nNot in the same servers as this instance: {instances}").format(
+                instances=", ".join(mismatched)
+            )
+        await ctx.send(box(msg))
+
+    @thetaset.group(name="trace")
+    @checks.is_owner()
+    async def _thetaset_trace(self, ctx: commands.Context):
+        """Trace and profile Theta poll cycles."""
+        pass
+
+    @_thetaset_trace.command(name="toggle")
+    async def _thetaset_trace_toggle(self, ctx: commands.Context, on_off: bool):
+        """Turn poll cycle tracing on or off.
+
+        Turning it on forgets the cycles traced so far.
+        """
+        self._tracer.enabled = on_off
+        if on_off:
+            self._tracer.clear()
+            await ctx.send(
+                _("Poll cycles are now traced, the {keep} slowest ones are kept.").format(
+                    keep=self._tracer.keep
+                )
+            )
+        else:
+            await ctx.send(_("Poll cycles are no longer traced."))
+
+    @_thetaset_trace.command(name="worst")
+    async def _thetaset_trace_worst(self, ctx: commands.Context):
+        """Show where the time went in the slowest traced poll cycle."""
+        slowest = self._tracer.slowest()
+        if not slowest:
+            if not self._tracer.enabled:
+                return await ctx.send(
+                    _(
+                        "Tracing is off, turn it on with `{prefix}thetaset trace toggle on`."
+                    ).format(prefix=ctx.clean_prefix)
+                )
+            return await ctx.send(_("No poll cycle has been traced yet."))
+
+        cycle = slowest[0]
+        msg = _(
+            "Cycle {id} started {started} and took {duration:.2f}s for {streams} streams\n"
+        ).format(
+            id=cycle.id,
+            started=time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(cycle.started_at)),
+            duration=cycle.duration,
+            streams=humanize_number(cycle.streams),
+        )
+        msg += _("\nTime per phase, summed over stream checks:\n")
+        for phase, seconds in sorted(cycle.phases.items(), key=lambda item: -item[1]):
+            msg += "  {:<16}{:>10.3f}s\n".format(phase, seconds)
+        msg += _("\nSlowest stream checks:\n")
+        for stream in cycle.stream_traces:
+            other = stream.duration - sum(stream.phases.values())
+            # Sub-millisecond phases only add noise here
+            phases = sorted(
+                (item for item in stream.phases.items() if item[1] >= 0.001),
+                key=lambda item: -item[1],
+            )
+            phases.append((_("other"), max(other, 0.0)))
+            msg += "  {} {}: {:.3f}s ({})\n".format(
+                stream.id,
+                stream.stream,
+                stream.duration,
+                ", ".join("{} {:.3f}s".format(phase, seconds) for phase, seconds in phases),
+            )
+        if len(slowest) > 1:
+            msg += _("\nOther slow cycles: {cycles}\n").format(
+                cycles=", ".join("{} {:.2f}s".format(c.id, c.duration) for c in slowest[1:])
+            )
+
+        for page in pagify(msg):
+            await ctx.send(box(page))
+
+    @_thetaset_trace.command(name="profile")
+    async def _thetaset_trace_profile(self, ctx: commands.Context, cycles: int = None):
+        """Profile the next poll cycles, or show the latest captures.
+
+        Profiling covers everything the bot does while a cycle runs, not only the
+        cog, and slows the cycle down.
+        """
+        if cycles is not None:
+            if cycles < 1:
+                return await ctx.send(_("The number of cycles must be at least 1."))
+            self._tracer.profile_cycles = cycles
+            return await ctx.send(
+                _("The next {cycles} poll cycles will be profiled.").format(cycles=cycles)
+            )
+        if not self._tracer.profiles:
+            return await ctx.send(
+                _(
+                    "No profile captured yet, use `{prefix}thetaset trace profile <cycles>`."
+                ).format(prefix=ctx.clean_prefix)
+            )
+        for label, captured_at, report in reversed(self._tracer.profiles):
+            header = _("Cycle {label} at {captured}\n").format(
+                label=label,
+                captured=time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(captured_at)),
+            )
+            for page in pagify(header + report, shorten_by=20):
+                await ctx.send(box(page))
+
     @thetaset.command()
     @checks.is_owner()
     async def thetatoken(self, ctx: commands.Context):
@@ -419,6 +982,7 @@ class Theta(commands.Cog):
         if message is not None:
             guild = ctx.guild
             await self.db.guild(guild).live_message_mention.set(message)
+            self._cache_guild_setting(guild, "live_message_mention", message)
             await ctx.send(_("Theta alert message set!"))
         else:
             await ctx.send_help()
@@ -433,6 +997,7 @@ class Theta(commands.Cog):
         if message is not None:
             guild = ctx.guild
             await self.db.guild(guild).live_message_nomention.set(message)
+            self._cache_guild_setting(guild, "live_message_nomention", message)
             await ctx.send(_("Theta alert message set!"))
         else:
             await ctx.send_help()
@@ -444,6 +1009,8 @@ class Theta(commands.Cog):
         guild = ctx.guild
         await self.db.guild(guild).live_message_mention.set(False)
         await self.db.guild(guild).live_message_nomention.set(False)
+        self._cache_guild_setting(guild, "live_message_mention", False)
+        self._cache_guild_setting(guild, "live_message_nomention", False)
         await ctx.send(_("Theta alerts in this server will now use the default alert message."))
 
     @thetaset.group()
@@ -460,9 +1027,11 @@ class Theta(commands.Cog):
         current_setting = await self.db.guild(guild).mention_everyone()
         if current_setting:
             await self.db.guild(guild).mention_everyone.set(False)
+            self._cache_guild_setting(guild, "mention_everyone", False)
             await ctx.send(_("`@\u200beveryone` will no longer be mentioned for stream alerts."))
         else:
             await self.db.guild(guild).mention_everyone.set(True)
+            self._cache_guild_setting(guild, "mention_everyone", True)
             await ctx.send(_("When a stream is live, `@\u200beveryone` will be mentioned."))
 
     @mention.command(aliases=["here"])
@@ -473,9 +1042,11 @@ class Theta(commands.Cog):
         current_setting = await self.db.guild(guild).mention_here()
         if current_setting:
             await self.db.guild(guild).mention_here.set(False)
+            self._cache_guild_setting(guild, "mention_here", False)
             await ctx.send(_("`@\u200bhere` will no longer be mentioned for stream alerts."))
         else:
             await self.db.guild(guild).mention_here.set(True)
+            self._cache_guild_setting(guild, "mention_here", True)
             await ctx.send(_("When a stream is live, `@\u200bhere` will be mentioned."))
 
     @mention.command()
@@ -485,35 +1056,53 @@ class Theta(commands.Cog):
         current_setting = await self.db.role(role).mention()
         if current_setting:
             await self.db.role(role).mention.set(False)
+            self._mention_roles.get(role.guild.id, set()).discard(role.id)
             await ctx.send(
-            _("`@\u200b{role.name}` will no longer be mentioned for stream alerts.").format(
-            role=role
-            )
+                _("`@\u200b{role.name}` will no longer be mentioned for stream alerts.").format(
+                    role=role
+                )
             )
         else:
             await self.db.role(role).mention.set(True)
+            self._mention_roles.setdefault(role.guild.id, set()).add(role.id)
             msg = _(
-            "When a Theta stream is live, `@\u200b{role.name}` will be mentioned."
+                "When a Theta stream is live, `@\u200b{role.name}` will be mentioned."
             ).format(role=role)
             if not role.mentionable:
                 msg += " " + _(
-                "Since the role is not mentionable, it will be momentarily made mentionable "
-                "when announcing a streamalert. Please make sure I have the correct "
-                "permissions to manage this role, or else members of this role won't receive "
-                "a notification."
+                    "Since the role is not mentionable, it will be momentarily made mentionable "
+                    "when announcing a streamalert. Please make sure I have the correct "
+                    "permissions to manage this role, or else members of this role won't receive "
+                    "a notification."
                 )
-                await ctx.send(msg)
+            await ctx.send(msg)
 
     @thetaset.command()
     @commands.guild_only()
     async def autodelete(self, ctx: commands.Context, on_off: bool):
         """Toggle alert deletion for when streams go offline."""
         await self.db.guild(ctx.guild).autodelete.set(on_off)
+        self._cache_guild_setting(ctx.guild, "autodelete", on_off)
         if on_off:
             await ctx.send(_("The notifications will be deleted once Theta streams go offline."))
         else:
             await ctx.send(_("Notifications will no longer be deleted."))
 
+    @thetaset.command(name="liveupdates")
+    @commands.guild_only()
+    async def live_updates(self, ctx: commands.Context, on_off: bool):
+        """Toggle editing posted alerts when a live Theta stream changes.
+
+        Alerts are only edited when the title, game or rerun status changes, or
+        when the follower or view count moves noticeably.
+        """
+        await self.db.guild(ctx.guild).live_updates.set(on_off)
+        self._cache_guild_setting(ctx.guild, "live_updates", on_off)
+        if on_off:
+            await ctx.send(_("Theta alerts will now be updated while the stream is live."))
+        else:
+            await ctx.send(_("Theta alerts will no longer be updated once posted."))
+
     @thetaset.command(name="ignorereruns")
     @commands.guild_only()
     async def ignore_reruns(self, ctx: commands.Context):
@@ -522,49 +1111,90 @@ class Theta(commands.Cog):
         current_setting = await self.db.guild(guild).ignore_reruns()
         if current_setting:
             await self.db.guild(guild).ignore_reruns.set(False)
+            self._cache_guild_setting(guild, "ignore_reruns", False)
             await ctx.send(_("Theta Streams of type 'rerun' will be included in alerts."))
         else:
             await self.db.guild(guild).ignore_reruns.set(True)
+            self._cache_guild_setting(guild, "ignore_reruns", True)
             await ctx.send(_("Theta Streams of type 'rerun' will no longer send an alert."))
 
-    async def add_or_remove(self, ctx: commands.Context, stream):
+    async def add_or_remove(self, ctx: commands.Context, theta):
         if ctx.channel.id not in theta.channels:
-            theta.channels.append(ctx.channel.id)
-            if theta not in self.theta:
-                self.theta.append(stream)
-                await ctx.send(
+            self._theta_index.add_channel(theta, ctx.channel.id)
+            self._dirty_theta.add(theta)
+            if theta not in self._theta_index:
+                self._add_theta(theta)
+            await ctx.send(
                 _(
-                "I'll now send a notification in this channel when {theta.name} is live."
-                ).format(theta=theta)
-                )
-            else:
-                theta.channels.remove(ctx.channel.id)
-                if not theta.channels:
-                    self.theta.remove(stream)
-                    await ctx.send(
-                    _(
-                    "I won't send notifications about {theta.name} in this channel anymore."
-                    ).format(theta=theta)
-                    )
+                    "I'll now send a notification in this channel when {theta} is live."
+                ).format(theta=theta.name or theta.id)
+            )
+        else:
+            self._theta_index.remove_channel(theta, ctx.channel.id)
+            self._dirty_theta.add(theta)
+            if not theta.channels:
+                self._remove_theta(theta)
+            await ctx.send(
+                _(
+                    "I won't send notifications about {theta} in this channel anymore."
+                ).format(theta=theta.name or theta.id)
+            )
 
-                    await self.save_theta()
+        await self._save_theta_edits()
 
     def get_theta(self, _class, name):
-        for theta in self.theta:
-            # if isinstance(theta, _class) and theta.name == name:
-            #    return theta stream
-            # Reloading this cog causes an issue with this check ^
-            # isinstance will always return False
-            # As a workaround, we'll compare the class' name instead.
-            # Good enough.
-            if _class.__name__ == "ThetaStream" and theta.type == _class.__name__:
-                # Because name could be a username or a channel id
-                if self.check_name_or_id(name) and theta.name.lower() == name.lower():
-                    return theta
-                elif not self.check_name_or_id(name) and theta.id == name:
-                    return theta
-                elif theta.type == _class.__name__ and theta.name.lower() == name.lower():
-                    return theta
+        # Because name could be a username or a user id
+        theta = None
+        if not self.check_name_or_id(name):
+            theta = self._theta_index.by_id.get(name)
+        # Logins can look like user IDs too
+        return theta or self._theta_index.by_name.get(name.lower())
+
+    @staticmethod
+    def _derive_record_key(stream_type: str, name: Optional[str], user_id: Optional[str]) -> str:
+        """Key of a stream's Config record, every instance derives the same one for a stream."""
+        return "{}:{}".format(stream_type, name.lower() if name else user_id)
+
+    def _add_theta(self, theta: ThetaStream) -> None:
+        if theta._record_key is None:
+            theta._record_key = self._derive_record_key(theta.type, theta.name, theta.id)
+        self.theta.append(theta)
+        self._theta_index.add(theta)
+        self._scheduler.add(theta)
+
+    def _remove_theta(self, theta: ThetaStream) -> None:
+        self._removed_records.add(theta._record_key)
+        self._forget_theta(theta)
+
+    def _forget_theta(self, theta: ThetaStream) -> None:
+        """Stop tracking a stream without touching its record."""
+        self.theta.remove(theta)
+        self._theta_index.remove(theta)
+        self._scheduler.remove(theta)
+        self._stream_locks.pop(theta, None)
+        self._live_theta.discard(theta)
+
+    def _set_theta(self, theta: List[ThetaStream]) -> None:
+        self.theta = theta
+        self._theta_index.rebuild(theta)
+        self._scheduler.rebuild(theta)
+        self._stream_locks.clear()
+        self._live_theta.clear()
+
+    def _stream_lock(self, theta: ThetaStream) -> asyncio.Lock:
+        lock = self._stream_locks.get(theta)
+        if lock is None:
+            lock = self._stream_locks[theta] = asyncio.Lock()
+        return lock
+
+    def _get_channel_guild_id(self, channel_id: int) -> Optional[int]:
+        channel = self.bot.get_channel(channel_id)
+        guild = getattr(channel, "guild", None)
+        return guild.id if guild is not None else None
+
+    def _make_theta(self, _class, **kwargs):
+        """Instantiate a stream bound to the cog's shared API client and metadata cache."""
+        return _class(client=self._client, cache=self._metadata_cache, **kwargs)
 
     @staticmethod
     async def check_exists(theta):
@@ -576,152 +1206,870 @@ class Theta(commands.Cog):
             return False
         except StreamsError:
             raise
-            return True
+        return True
 
     async def _theta_alerts(self):
         await self.bot.wait_until_ready()
         while True:
             try:
-                await self.check_theta()
-            except asyncio.CancelledError:
-                pass
-                await asyncio.sleep(await self.db.refresh_timer())
-
-    async def check_theta(self):
-        for theta in self.theta:
-            with contextlib.suppress(Exception):
+                due = self._scheduler.due()
+                if self._shard is not None:
+                    due = [theta for theta in due if self._owns(theta)]
+                if due and self._api_unavailable():
+                    # Every check would be refused anyway. The streams were rescheduled by
+                    # due() and are checked again once the circuit lets requests through.
+                    self._metrics.inc("theta_poll_cycles_skipped_total")
+                    due = []
+                if due:
+                    await self.check_theta(due)
+            except Exception as error:
+                log.exception("Theta poll cycle failed:", exc_info=error)
+            await asyncio.sleep(self._scheduler.seconds_until_next())
+
+    async def check_theta(self, theta_list: Optional[List[ThetaStream]] = None):
+        """Check the given streams (all of them by default), ``poll_concurrency`` at a time.
+
+        A fixed pool of workers drains a shared queue, so a slow stream only ties
+        up its own worker and never holds back alerts for the others.
+        """
+        if theta_list is None:
+            theta_list = self.theta
+        started = time.monotonic()
+        # Embeds built within the same epoch share their thumbnail cache-buster
+        self._poll_epoch = int(time.time()) // self._scheduler.refresh_timer
+        if not theta_list:
+            return
+        cycle = self._tracer.start_cycle(len(theta_list))
+        profiler = self._tracer.start_profile()
+        try:
+            await self._poll_streams(theta_list, cycle)
+        finally:
+            duration = time.monotonic() - started
+            if cycle is not None:
+                label = "{} ({} streams)".format(cycle.id, len(theta_list))
+            else:
+                label = "{} streams".format(len(theta_list))
+            self._tracer.finish_profile(profiler, label)
+            self._tracer.finish_cycle(cycle, duration)
+        self._metrics.observe("theta_poll_cycle_seconds", duration)
+        self._metrics.set("theta_poll_cycle_streams", len(theta_list))
+        self._metrics.inc("theta_streams_checked_total", len(theta_list))
+
+    async def _poll_streams(self, theta_list: List[ThetaStream], cycle: Optional[CycleTrace]):
+        with trace_phase("config"):
+            token = await self.bot.get_shared_api_tokens("theta")
+            concurrency = min(await self.db.poll_concurrency(), len(theta_list))
+
+        # Roles made mentionable during this cycle, reverted once it is over
+        edited_roles: Dict[int, Tuple[discord.Role, asyncio.Future]] = {}
+        try:
+            if self._poll_worker is None:
+                await self._poll_in_cog(theta_list, cycle, token, concurrency, edited_roles)
+            else:
                 try:
-                    if theta.__class__.__name__ == "ThetaStream":
-                        await self.maybe_renew_theta_bearer_token()
-                        embed, is_rerun = await theta.is_online()
-                    else:
-                        embed = await theta.is_online()
-                        is_rerun = False
-                except OfflineStream:
-                    if not theta._messages_cache:
-                        continue
-                        for message in theta._messages_cache:
-                            with contextlib.suppress(Exception):
-                                autodelete = await self.db.guild(message.guild).autodelete()
-                                if autodelete:
-                                    await message.delete()
-                                    theta._messages_cache.clear()
-                                    await self.save_theta()
-                                else:
-                                    if theta._messages_cache:
-                                        continue
-                                        for channel_id in theta.channels:
-                                            channel = self.bot.get_channel(channel_id)
-                                            if not channel:
-                                                continue
-                                                ignore_reruns = await self.db.guild(channel.guild).ignore_reruns()
-                                                if ignore_reruns and is_rerun:
-                                                    continue
-                                                    mention_str, edited_roles = await self._get_mention_str(channel.guild)
-
-                                                    if mention_str:
-                                                        alert_msg = await self.db.guild(channel.guild).live_message_mention()
-                                                        if alert_msg:
-                                                            content = alert_msg.format(mention=mention_str, theta=theta)
-                                                        else:
-                                                            content = _("{mention}, {theta} is now live!").format(
-                                                            mention=mention_str,
-                                                            theta=escape(
-                                                            str(theta.name), mass_mentions=True, formatting=True
-                                                            ),
-                                                            )
-                                                    else:
-                                                        alert_msg = await self.db.guild(channel.guild).live_message_nomention()
-                                                        if alert_msg:
-                                                            content = alert_msg.format(theta=theta)
-                                                        else:
-                                                            content = _("{theta} is now live!").format(
-                                                            theta=escape(
-                                                            str(theta.name), mass_mentions=True, formatting=True
-                                                            ),
-                                                            )
-
-                                                    m = await channel.send(content, embed=embed)
-                                                    theta._messages_cache.append(m)
-                                                    if edited_roles:
-                                                        for role in edited_roles:
-                                                            await role.edit(mentionable=False)
-                                                            await self.save_theta()
-
-    async def _get_mention_str(self, guild: discord.Guild) -> Tuple[str, List[discord.Role]]:
-        """Returns a 2-tuple with the string containing the mentions, and a list of
-        all roles which need to have their `mentionable` property set back to False.
+                    await self._poll_in_worker(
+                        theta_list, cycle, token, concurrency, edited_roles
+                    )
+                except PollWorkerError as error:
+                    # Streams it already reported were updated, checking them again is harmless
+                    log.warning("Theta poll worker failed, polling from the bot: %s", error)
+                    await self._poll_in_cog(theta_list, cycle, token, concurrency, edited_roles)
+        finally:
+            with trace_phase("restore_roles"):
+                await self._restore_mentionable_roles(edited_roles)
+        if self._has_unsaved_changes():
+            self._schedule_save()
+
+    async def _poll_in_cog(
+        self,
+        theta_list: List[ThetaStream],
+        cycle: Optional[CycleTrace],
+        token: dict,
+        concurrency: int,
+        edited_roles: dict,
+    ) -> None:
+        # The client adds the bearer token kept fresh by the token manager
+        headers = get_headers(token.get("client_id"))
+        statuses = await self._status_batcher.fetch(
+            headers, [theta.id for theta in theta_list if theta.id]
+        )
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for theta in theta_list:
+            queue.put_nowait((theta, statuses.get(theta.id)))
+        workers = [
+            self._theta_poll_worker(queue, edited_roles, cycle)
+            for _loop_counter in range(concurrency)
+        ]
+        await asyncio.gather(*workers)
+
+    async def _poll_in_worker(
+        self,
+        theta_list: List[ThetaStream],
+        cycle: Optional[CycleTrace],
+        token: dict,
+        concurrency: int,
+        edited_roles: dict,
+    ) -> None:
+        """Have the poll worker process check the streams, and act on what it reports.
+
+        The worker only reports streams whose alerts need attention, the others
+        are known to be as live or offline as at their previous check.
+        """
+        jobs = []
+        for index, theta in enumerate(theta_list):
+            # Also fills in the ID from the index, so it comes before reading theta.id
+            resolve = bool(theta.name) and not self._index_theta_id(theta)
+            jobs.append(
+                StreamJob(
+                    index,
+                    theta.name,
+                    theta.id,
+                    resolve,
+                    theta in self._live_theta,
+                    bool(theta._messages_cache),
+                    theta._posted_state,
+                )
+            )
+        outcomes: asyncio.Queue = asyncio.Queue()
+        reported: Set[int] = set()
+
+        async def receive():
+            try:
+                async for outcome in self._poll_worker.poll(
+                    token.get("client_id"),
+                    self._token_manager.bearer,
+                    self._poll_epoch,
+                    concurrency,
+                    jobs,
+                    self._metrics,
+                ):
+                    reported.add(outcome.index)
+                    outcomes.put_nowait(outcome)
+            finally:
+                for _loop_counter in range(concurrency):
+                    outcomes.put_nowait(None)
+
+        handlers = [
+            self._theta_outcome_worker(outcomes, theta_list, edited_roles, cycle)
+            for _loop_counter in range(concurrency)
+        ]
+        # Let the handlers finish what was reported even if the worker fails
+        results = await asyncio.gather(receive(), *handlers, return_exceptions=True)
+        if isinstance(results[0], BaseException):
+            raise results[0]
+
+        for index, theta in enumerate(theta_list):
+            if index in reported:
+                continue
+            if theta in self._live_theta:
+                self._metrics.inc("theta_stream_checks_total", result="live")
+                self._scheduler.mark_live(theta)
+            else:
+                self._metrics.inc("theta_stream_checks_total", result="offline")
+                self._scheduler.mark_offline(theta)
+
+    async def _theta_poll_worker(
+        self, queue: asyncio.Queue, edited_roles: dict, cycle: Optional[CycleTrace]
+    ) -> None:
+        while True:
+            try:
+                theta, prefetched = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            with self._tracer.stream(cycle, theta.name or theta.id):
+                try:
+                    async with self._stream_lock(theta):
+                        changed = await self._check_theta_stream(theta, prefetched, edited_roles)
+                    if changed:
+                        self._dirty_theta.add(theta)
+                except (
+                    APIError,
+                    InvalidThetaCredentials,
+                    StreamsError,
+                    aiohttp.ClientConnectionError,
+                ) as error:
+                    # API and network failures are expected now and then, count them without a
+                    # traceback
+                    self._metrics.inc(
+                        "theta_stream_check_errors_total", error=type(error).__name__
+                    )
+                    log.debug("Theta API error while checking %r: %r", theta, error)
+                except Exception as error:
+                    self._metrics.inc(
+                        "theta_stream_check_errors_total", error=type(error).__name__
+                    )
+                    log.exception("Failed to check %r", theta, exc_info=error)
+            # is_online may have learnt a new display name or user ID
+            if self._theta_index.refresh(theta):
+                self._dirty_theta.add(theta)
+
+    async def _theta_outcome_worker(
+        self,
+        outcomes: asyncio.Queue,
+        theta_list: List[ThetaStream],
+        edited_roles: dict,
+        cycle: Optional[CycleTrace],
+    ) -> None:
+        while True:
+            outcome = await outcomes.get()
+            if outcome is None:
+                return
+            theta = theta_list[outcome.index]
+            with self._tracer.stream(cycle, theta.name or theta.id):
+                try:
+                    async with self._stream_lock(theta):
+                        changed = await self._apply_theta_outcome(theta, outcome, edited_roles)
+                    if changed:
+                        self._dirty_theta.add(theta)
+                except Exception as error:
+                    self._metrics.inc(
+                        "theta_stream_check_errors_total", error=type(error).__name__
+                    )
+                    log.exception("Failed to handle the check of %r", theta, exc_info=error)
+            if self._theta_index.refresh(theta):
+                self._dirty_theta.add(theta)
+
+    async def _check_theta_stream(
+        self, theta: ThetaStream, prefetched: Optional[dict], edited_roles: dict
+    ) -> bool:
+        """Poll a single stream and send or clean up its alerts.
+
+        ``prefetched`` is the stream's batched live-status entry, if there is one.
+        ``edited_roles`` is shared by the whole cycle, see `_get_mention_str`.
+        Returns whether the stream's message cache changed and its record needs saving.
+        """
+        try:
+            await self._ensure_theta_id(theta)
+            embed, is_rerun = await asyncio.wait_for(
+                theta.is_online(prefetched, self._poll_epoch), THETA_POLL_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            log.debug("Timed out while checking %r", theta)
+            self._metrics.inc("theta_stream_checks_total", result="timeout")
+            return False
+        except StreamNotFound:
+            self._metrics.inc("theta_stream_checks_total", result="not_found")
+            self._forget_theta_id(theta)
+            return False
+        except OfflineStream:
+            self._metrics.inc("theta_stream_checks_total", result="offline")
+            return await self._stream_offline(theta)
+
+        self._metrics.inc("theta_stream_checks_total", result="live")
+        return await self._stream_live(theta, embed, is_rerun, edited_roles)
+
+    async def _apply_theta_outcome(
+        self, theta: ThetaStream, outcome: StreamOutcome, edited_roles: dict
+    ) -> bool:
+        """Act on a stream check done by the poll worker, like `_check_theta_stream`."""
+        theta.name = outcome.name
+        theta.id = outcome.id
+        if outcome.result == "error":
+            self._metrics.inc("theta_stream_check_errors_total", error=outcome.error)
+            if outcome.expected:
+                log.debug("Theta API error while checking %r: %s", theta, outcome.detail)
+            else:
+                log.error("Poll worker failed to check %r: %s", theta, outcome.detail)
+            return False
+        self._metrics.inc("theta_stream_checks_total", result=outcome.result)
+        if outcome.result == "timeout":
+            log.debug("Timed out while checking %r", theta)
+            return False
+        if outcome.result == "not_found":
+            self._forget_theta_id(theta)
+            return False
+        if theta.name and not self._index_theta_id(theta):
+            # The worker was asked to resolve the ID
+            self._remember_theta_id(theta.name.lower(), theta.id)
+        if outcome.result == "offline":
+            return await self._stream_offline(theta)
+        theta._embed_state = outcome.embed_state
+        embed = discord.Embed.from_dict(outcome.embed)
+        return await self._stream_live(theta, embed, outcome.is_rerun, edited_roles)
+
+    async def _stream_offline(self, theta: ThetaStream) -> bool:
+        """Clean up the alerts of a stream found offline, returns whether any were posted."""
+        self._scheduler.mark_offline(theta)
+        self._live_theta.discard(theta)
+        if not theta._messages_cache:
+            return False
+        for channel_id, message_id in theta._messages_cache:
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                continue
+            with contextlib.suppress(Exception), trace_phase("discord_delete"):
+                if self._get_guild_settings(channel.guild)["autodelete"]:
+                    await channel.get_partial_message(message_id).delete()
+        theta._messages_cache.clear()
+        return True
+
+    async def _stream_live(
+        self, theta: ThetaStream, embed: discord.Embed, is_rerun: bool, edited_roles: dict
+    ) -> bool:
+        """Send or update the alerts of a stream found live.
+
+        Returns whether its message cache changed.
+        """
+        self._scheduler.mark_live(theta)
+        self._live_theta.add(theta)
+        if theta._messages_cache:
+            if theta._posted_state is None:
+                # First check since these alerts were loaded, take it as the baseline
+                theta._posted_state = theta._embed_state
+            elif theta.embed_changed():
+                with trace_phase("discord_edit"):
+                    await self._update_live_alerts(theta, embed)
+            return False
+        detected_at = time.monotonic()
+        alerts = []
+        for channel_id in theta.channels:
+            channel = self.bot.get_channel(channel_id)
+            if not channel:
+                continue
+            settings = self._get_guild_settings(channel.guild)
+            if settings["ignore_reruns"] and is_rerun:
+                continue
+            with trace_phase("mentions"):
+                mention_str = await self._get_mention_str(channel.guild, edited_roles)
+            alerts.append((channel, self._make_alert_content(settings, mention_str, theta)))
+
+        with trace_phase("discord_send"):
+            results = await asyncio.gather(
+                *(
+                    self._dispatcher.send(channel, content, embed=embed, detected_at=detected_at)
+                    for channel, content in alerts
+                ),
+                return_exceptions=True,
+            )
+        for (channel, content), result in zip(alerts, results):
+            if isinstance(result, Exception):
+                log.debug("Could not send Theta alert to channel %s", channel.id, exc_info=result)
+            else:
+                theta._messages_cache.append((channel.id, result.id))
+        theta._posted_state = theta._embed_state
+        return bool(theta._messages_cache)
+
+    @staticmethod
+    def _make_alert_content(settings: dict, mention_str: str, theta: ThetaStream) -> str:
+        """Returns the text of a live alert, using the guild's custom message if set."""
+        if mention_str:
+            alert_msg = settings["live_message_mention"]
+            # The default is True rather than a message, which means the built-in one
+            if isinstance(alert_msg, str) and alert_msg:
+                return alert_msg.format(mention=mention_str, theta=theta)
+            return _("{mention}, {theta} is now live!").format(
+                mention=mention_str,
+                theta=escape(str(theta.name), mass_mentions=True, formatting=True),
+            )
+        alert_msg = settings["live_message_nomention"]
+        if isinstance(alert_msg, str) and alert_msg:
+            return alert_msg.format(theta=theta)
+        return _("{theta} is now live!").format(
+            theta=escape(str(theta.name), mass_mentions=True, formatting=True),
+        )
+
+    async def _update_live_alerts(self, theta: ThetaStream, embed: discord.Embed) -> None:
+        """Edit the posted alerts in guilds that enabled live updates."""
+        edits = []
+        for channel_id, message_id in theta._messages_cache:
+            channel = self.bot.get_channel(channel_id)
+            if channel is None or not self._get_guild_settings(channel.guild)["live_updates"]:
+                continue
+            message = channel.get_partial_message(message_id)
+            edits.append(self._dispatcher.edit(message, embed=embed))
+        if edits:
+            await asyncio.gather(*edits, return_exceptions=True)
+        theta._posted_state = theta._embed_state
+
+    async def _handle_theta_event(self, event: dict) -> None:
+        """Run a go-live or go-offline webhook event through the poll path's alert logic."""
+        theta = self._theta_index.by_id.get(str(event["user_id"]))
+        if theta is None or not self._owns(theta):
+            return
+        if event["type"] == EVENT_ONLINE:
+            entry = event.get("data")
+            if isinstance(entry, dict) and all(field in entry for field in THETA_EVENT_FIELDS):
+                prefetched = {"data": [dict(entry)]}
+            else:
+                # Not enough to build the embed from, ask the API instead
+                prefetched = None
+        else:
+            prefetched = {"data": []}
+
+        edited_roles: Dict[int, Tuple[discord.Role, asyncio.Future]] = {}
+        try:
+            async with self._stream_lock(theta):
+                changed = await self._check_theta_stream(theta, prefetched, edited_roles)
+        finally:
+            await self._restore_mentionable_roles(edited_roles)
+        # The event may carry a new display name
+        if self._theta_index.refresh(theta):
+            changed = True
+        if changed:
+            self._dirty_theta.add(theta)
+        if self._has_unsaved_changes():
+            self._schedule_save()
+
+    async def _start_webhook(self, port: int) -> None:
+        secret = (await self.bot.get_shared_api_tokens("theta")).get("webhook_secret")
+        if not secret:
+            log.error("Theta webhooks need a secret, set one as the theta webhook_secret token.")
+            raise InvalidThetaCredentials()
+        if self._webhook is None:
+            self._webhook = WebhookReceiver(secret, self._handle_theta_event, self._metrics)
+        self._webhook.secret = secret
+        try:
+            await self._webhook.start(port)
+        except OSError as error:
+            log.error("Could not receive Theta events on port %s: %s", port, error)
+            raise
+
+    @staticmethod
+    def _shard_key(theta: ThetaStream) -> Optional[str]:
+        if theta.id:
+            return theta.id
+        # Only until the ID is resolved, which load_theta and adding the alert usually do
+        return theta.name.lower() if theta.name else None
+
+    def _owns(self, theta: ThetaStream) -> bool:
+        """Whether this instance polls the stream, always true unless sharding is on."""
+        return self._shard is None or self._shard.owns(self._shard_key(theta))
+
+    @staticmethod
+    def _instance_name() -> str:
+        name = data_manager.instance_name
+        # A function since Red 3.5, a plain attribute before
+        if callable(name):
+            name = name()
+        return name or "{}-{}".format(socket.gethostname(), os.getpid())
+
+    def _guild_fingerprint(self) -> str:
+        """Digest of the guilds this instance is in, instances sharing polling must match."""
+        guild_ids = sorted(guild.id for guild in self.bot.guilds)
+        return hashlib.blake2b(",".join(map(str, guild_ids)).encode(), digest_size=8).hexdigest()
+
+    async def _start_sharding(self, directory: str) -> None:
+        if self._shard is not None:
+            await self._shard.close()
+        self._shard = ShardCoordinator(
+            directory,
+            self._instance_name(),
+            self._on_shard_beat,
+            fingerprint=self._guild_fingerprint,
+        )
+        try:
+            previous = await self._shard.beat()
+        except OSError as error:
+            log.error("Could not share Theta polling through %s: %s", directory, error)
+            self._shard = None
+            raise
+        await self._on_shard_beat(previous)
+        self._shard.start()
+
+    async def _stop_sharding(self) -> None:
+        if self._shard is not None:
+            shard, self._shard = self._shard, None
+            await shard.close()
+
+    async def _on_shard_beat(self, previous: Optional[frozenset]) -> None:
+        """Catch up with the other instances after a heartbeat.
+
+        ``previous`` is the membership before this heartbeat if it changed.
         """
-        settings = self.db.guild(guild)
+        mismatched = self._shard.mismatched()
+        if mismatched and (previous is not None or not self._shard_mismatch_logged):
+            log.error(
+                "Theta instances %s are not in the same servers as this one, alerts in "
+                "channels their owner can't see won't be sent",
+                ", ".join(mismatched),
+            )
+        self._shard_mismatch_logged = bool(mismatched)
+        if previous is not None or await self.db.records_revision() != self._records_revision:
+            await self._sync_theta_records()
+        if previous is not None:
+            await self._reload_taken_over(previous)
+
+    async def _sync_theta_records(self) -> None:
+        """Track the streams other instances added or removed, and their alert channels."""
+        self._records_revision = await self.db.records_revision()
+        records = await self.db.custom(THETA_STREAM_GROUP).all()
+        for theta in list(self.theta):
+            record = records.get(theta._record_key)
+            if record is None:
+                # Not yet saved if this instance never saw it, deleted elsewhere otherwise
+                if theta._record_key in self._known_records:
+                    self._forget_theta(theta)
+                continue
+            channels = record.get("channels", [])
+            for channel_id in set(theta.channels).difference(channels):
+                self._theta_index.remove_channel(theta, channel_id)
+            for channel_id in channels:
+                if channel_id not in theta.channels:
+                    self._theta_index.add_channel(theta, channel_id)
+        tracked = {theta._record_key for theta in self.theta}
+        token = await self.bot.get_shared_api_tokens(ThetaStream.token_name)
+        for record_key, raw_theta in records.items():
+            if record_key not in tracked:
+                theta = self._theta_from_record(record_key, raw_theta, token)
+                if theta is not None:
+                    self._add_theta(theta)
+        self._known_records = set(records)
+
+    async def _reload_taken_over(self, previous: frozenset) -> None:
+        """Reload the alerts of streams taken over from another instance.
+
+        Their previous owner saved the alerts it posted to the shared Config, knowing
+        them keeps this instance from posting the same alerts again.
+        """
+        group = self.db.custom(THETA_STREAM_GROUP)
+        for theta in list(self.theta):
+            key = self._shard_key(theta)
+            if key is None or not self._owns(theta):
+                continue
+            if rendezvous_owner(previous, key) == self._shard.instance:
+                continue
+            try:
+                record = await group.get_raw(theta._record_key)
+            except KeyError:
+                continue
+            theta._messages_cache = [
+                (message["channel"], message["message"])
+                for message in record.get("messages", [])
+                if self.bot.get_channel(message["channel"]) is not None
+            ]
+            theta._posted_state = None
+
+    async def _update_poll_interval(self) -> None:
+        """Poll at the refresh timer, or only sweep at the sweep timer while webhooks are on."""
+        refresh_timer = await self.db.refresh_timer()
+        if self._webhook is not None and self._webhook.port:
+            refresh_timer = max(refresh_timer, await self.db.sweep_timer())
+        self._scheduler.refresh_timer = refresh_timer
+
+    def _get_cached_theta_id(self, name: str) -> Optional[str]:
+        entry = self._theta_ids.get(name.lower())
+        return entry["id"] if entry else None
+
+    async def _ensure_theta_id(self, theta: ThetaStream) -> None:
+        """Make sure the stream has a user ID, using the persistent index when possible.
+
+        The API is only asked again once the index entry is older than
+        ``THETA_ID_REVALIDATE_INTERVAL``.
+        """
+        if not theta.name:
+            return
+        if self._index_theta_id(theta):
+            return
+        login = theta.name.lower()
+        if login not in self._theta_ids and theta.id:
+            self._remember_theta_id(login, theta.id)
+            return
+        try:
+            theta.id = await theta.fetch_id()
+        except StreamNotFound:
+            # The name may be a display name or the user renamed themselves, the ID still
+            # stands until the live-status endpoint says otherwise
+            if not theta.id:
+                raise
+        self._remember_theta_id(login, theta.id)
+
+    def _index_theta_id(self, theta: ThetaStream) -> bool:
+        """Fill in the stream's user ID from the index, returns whether its entry is fresh."""
+        entry = self._theta_ids.get(theta.name.lower())
+        if entry is None:
+            return False
+        if not theta.id:
+            theta.id = entry["id"]
+        return time.time() - entry["resolved_at"] < THETA_ID_REVALIDATE_INTERVAL
+
+    def _remember_theta_id(self, login: str, user_id: str) -> None:
+        """Index a resolved user ID, it is written to Config with the next save."""
+        self._theta_ids[login] = {"id": user_id, "resolved_at": time.time()}
+        self._changed_theta_ids.add(login)
+
+    def _forget_theta_id(self, theta: ThetaStream) -> None:
+        """Drop a stream's indexed user ID so it gets resolved again next time."""
+        if not theta.name:
+            return
+        theta.id = None
+        if self._theta_ids.pop(theta.name.lower(), None) is not None:
+            self._changed_theta_ids.add(theta.name.lower())
+
+    async def _start_metrics_server(self, port: int) -> None:
+        try:
+            await self._metrics_server.start(port)
+        except OSError as error:
+            log.error("Could not serve Theta metrics on port %s: %s", port, error)
+            raise
+
+    def _api_unavailable(self) -> bool:
+        """Whether the circuit breaker of the client used for polling refuses requests."""
+        if self._poll_worker is not None:
+            return self._poll_worker.breaker_rejecting
+        return self._breaker.rejecting
+
+    def _on_breaker_change(self, previous: str, state: str) -> None:
+        # With a poll worker, polling depends on the circuit breaker of the worker's client
+        if self._poll_worker is None:
+            self._report_circuit_change(previous, state)
+
+    def _report_circuit_change(self, previous: str, state: str) -> None:
+        """Let the bot owners know when the API goes down and when it is back."""
+        self._metrics.set("theta_api_circuit_state", CIRCUIT_STATES.index(state))
+        if state == CIRCUIT_OPEN and previous == CIRCUIT_CLOSED:
+            log.warning("Theta API requests keep failing, pausing polling until it recovers.")
+            message = _(
+                "The Theta API seems to be down, Theta streams won't be checked until it "
+                "answers again. You will be told once it does."
+            )
+        elif state == CIRCUIT_CLOSED:
+            log.info("Theta API is answering again, resuming polling.")
+            message = _("The Theta API is answering again, Theta streams are checked as usual.")
+        else:
+            return
+        self.bot.loop.create_task(send_to_owners_with_prefix_replaced(self.bot, message))
+
+    def _start_poll_worker(self) -> None:
+        if self._poll_worker is None:
+            self._poll_worker = PollWorker(self._report_circuit_change)
+        try:
+            self._poll_worker.start()
+        except OSError as error:
+            log.error("Could not start the Theta poll worker: %s", error)
+            self._poll_worker = None
+            raise
+
+    async def _stop_poll_worker(self) -> None:
+        if self._poll_worker is not None:
+            worker, self._poll_worker = self._poll_worker, None
+            await worker.close()
+
+    def _collect_metrics(self) -> None:
+        """Copy the metadata cache's own statistics into the metrics."""
+        cache = self._metadata_cache
+        # Added by difference, as other sources add to the same counters
+        for field, count in (cache.hits - self._cache_hits).items():
+            self._metrics.inc("theta_cache_hits_total", count, field=field)
+        for field, count in (cache.misses - self._cache_misses).items():
+            self._metrics.inc("theta_cache_misses_total", count, field=field)
+        self._cache_hits = Counter(cache.hits)
+        self._cache_misses = Counter(cache.misses)
+        if self._poll_worker is None:
+            # Polling uses the worker's cache otherwise, whose size comes with every cycle
+            self._metrics.set("theta_cache_entries", len(cache))
+
+    def _render_metrics(self) -> str:
+        self._collect_metrics()
+        return self._metrics.render_prometheus()
+
+    def _get_guild_settings(self, guild: discord.Guild) -> dict:
+        """Returns the guild's settings from the in-memory snapshot, without awaiting Config."""
+        return self._guild_settings.get(guild.id, self.guild_defaults)
+
+    def _cache_guild_setting(self, guild: discord.Guild, key: str, value) -> None:
+        """Mirror a guild setting that was just saved to Config into the snapshot."""
+        self._guild_settings.setdefault(guild.id, dict(self.guild_defaults))[key] = value
+
+    async def _get_mention_str(self, guild: discord.Guild, edited_roles: dict) -> str:
+        """Returns the string containing the mentions for an alert in the guild.
+
+        Roles that aren't mentionable are made mentionable at most once per poll
+        cycle: the edit is recorded in ``edited_roles`` (role ID -> role and edit
+        task), reused by every later alert, and reverted by
+        `_restore_mentionable_roles` when the cycle ends.
+        """
+        settings = self._get_guild_settings(guild)
         mentions = []
-        edited_roles = []
-        if await settings.mention_everyone():
-                mentions.append("@everyone")
-        if await settings.mention_here():
-                mentions.append("@here")
-                can_manage_roles = guild.me.guild_permissions.manage_roles
-        for role in guild.roles:
-            if await self.db.role(role).mention():
-                if can_manage_roles and not role.mentionable:
-                    try:
-                        await role.edit(mentionable=True)
-                    except discord.Forbidden:
+        if settings["mention_everyone"]:
+            mentions.append("@everyone")
+        if settings["mention_here"]:
+            mentions.append("@here")
+        can_manage_roles = guild.me.guild_permissions.manage_roles
+        roles = filter(None, map(guild.get_role, self._mention_roles.get(guild.id, ())))
+        for role in sorted(roles):
+            if can_manage_roles and (not role.mentionable or role.id in edited_roles):
+                if role.id not in edited_roles:
+                    edit = asyncio.ensure_future(role.edit(mentionable=True))
+                    edited_roles[role.id] = (role, edit)
+                try:
+                    await asyncio.shield(edited_roles[role.id][1])
+                except discord.Forbidden:
                     # Might still be unable to edit role based on hierarchy
-                        pass
-                else:
-                    edited_roles.append(role)
-                    mentions.append(role.mention)
-                return " ".join(mentions), edited_roles
+                    pass
+            mentions.append(role.mention)
+        return " ".join(mentions)
+
+    @staticmethod
+    async def _restore_mentionable_roles(edited_roles: dict) -> None:
+        for role, edit in edited_roles.values():
+            if not edit.done():
+                with contextlib.suppress(Exception):
+                    await edit
+            if edit.cancelled() or edit.exception() is not None:
+                continue
+            with contextlib.suppress(discord.HTTPException):
+                await role.edit(mentionable=False)
+        edited_roles.clear()
+
+    def _index_mention_roles(self, all_roles: Dict[int, dict]) -> None:
+        enabled = {role_id for role_id, data in all_roles.items() if data.get("mention")}
+        self._mention_roles = {}
+        for guild in self.bot.guilds:
+            for role in guild.roles:
+                if role.id in enabled:
+                    self._mention_roles.setdefault(guild.id, set()).add(role.id)
 
     async def filter_theta(self, streams: list, channel: discord.TextChannel) -> list:
         filtered = []
-        for theta in theta:
+        for theta in streams:
             th_id = str(theta["channel"]["_id"])
-        for alert in self.theta:
-            if isinstance(alert, ThetaStream) and alert.id == th_id:
-                if channel.id in alert.channels:
-                    break
-                else:
-                    filtered.append(theta)
-                return filtered
+            alert = self._theta_index.by_id.get(th_id)
+            if alert is None or channel.id not in alert.channels:
+                filtered.append(theta)
+        return filtered
 
     async def load_theta(self):
         theta = []
+        token = await self.bot.get_shared_api_tokens(ThetaStream.token_name)
+        # Read first, so changes made while the records are read show up as a new revision
+        self._records_revision = await self.db.records_revision()
+        records = await self.db.custom(THETA_STREAM_GROUP).all()
+        if not records:
+            records = await self._migrate_theta_records()
+        self._known_records = set(records)
+        for record_key, raw_theta in records.items():
+            stream = self._theta_from_record(record_key, raw_theta, token)
+            if stream is not None:
+                theta.append(stream)
+
+        return theta
+
+    def _theta_from_record(
+        self, record_key: str, raw_theta: dict, token: dict
+    ) -> Optional[ThetaStream]:
+        _class = getattr(_thetatypes, raw_theta["type"], None)
+        if not _class:
+            return None
+        raw_theta["_record_key"] = record_key
+        raw_msg_cache = raw_theta["messages"]
+        raw_theta["_messages_cache"] = []
+        for raw_msg in raw_msg_cache:
+            # Only the IDs are kept, a partial message is built from them when the
+            # alert has to be edited or deleted, so nothing is fetched from Discord here.
+            if self.bot.get_channel(raw_msg["channel"]) is not None:
+                raw_theta["_messages_cache"].append((raw_msg["channel"], raw_msg["message"]))
+        if token:
+            raw_theta["token"] = token.get("client_id")
+        if not raw_theta.get("id") and raw_theta.get("name"):
+            raw_theta["id"] = self._get_cached_theta_id(raw_theta["name"])
+        return self._make_theta(_class, **raw_theta)
+
+    async def _migrate_theta_records(self) -> Dict[str, dict]:
+        """Move streams saved in the old global ``theta`` list into per-stream records."""
+        records = {}
         for raw_theta in await self.db.theta():
-            _class = getattr(_thetatypes, raw_theta["type"], None)
-            if not _class:
+            record_key = self._derive_record_key(
+                raw_theta["type"], raw_theta.get("name"), raw_theta.get("id")
+            )
+            if record_key not in records:
+                records[record_key] = raw_theta
                 continue
-                raw_msg_cache = raw_theta["messages"]
-                raw_theta["_messages_cache"] = []
-                for raw_msg in raw_msg_cache:
-                    chn = self.bot.get_channel(raw_msg["channel"])
-                    if chn is not None:
-                        try:
-                            msg = await chn.fetch_message(raw_msg["message"])
-                        except discord.HTTPException:
-                            pass
-                        else:
-                            raw_theta["_messages_cache"].append(msg)
-                            token = await self.bot.get_shared_api_tokens(_class.token_name)
-                            if token:
-                                if _class.__name__ == "ThetaStream":
-                                    raw_theta["token"] = token.get("client_id")
-                                    raw_theta["bearer"] = self.ttv_bearer_cache.get("access_token", None)
-                                else:
-                                    raw_theta["token"] = token
-                                    theta.append(_class(**raw_theta))
-
-                                    return theta
+            # The same stream was tracked twice, one record alerts in all of its channels
+            record = records[record_key]
+            record["channels"].extend(
+                channel_id
+                for channel_id in raw_theta["channels"]
+                if channel_id not in record["channels"]
+            )
+            record["messages"].extend(raw_theta["messages"])
+        if records:
+            await self.db.custom(THETA_STREAM_GROUP).set(records)
+            await self.db.theta.clear()
+        return records
 
     async def save_theta(self):
-        raw_theta = []
-        for theta in self.theta:
-            raw_theta.append(theta.export())
+        """Write the records of every added, changed or removed stream to Config.
 
-        await self.db.theta.set(raw_theta)
+        User IDs indexed since the previous save are written along with them.
+        """
+        dirty, self._dirty_theta = self._dirty_theta, set()
+        removed, self._removed_records = self._removed_records, set()
+        changed_ids, self._changed_theta_ids = self._changed_theta_ids, set()
+        if changed_ids:
+            # One write for all of them rather than one per stream
+            async with self.db.user_ids() as user_ids:
+                for login in changed_ids:
+                    if login in self._theta_ids:
+                        user_ids[login] = self._theta_ids[login]
+                    else:
+                        user_ids.pop(login, None)
+        dirty = [theta for theta in dirty if theta in self._theta_index]
+        if not dirty and not removed:
+            return
+        # Config writes the whole file for each change, so all records go in one write
+        async with self.db.custom(THETA_STREAM_GROUP).all() as records:
+            for record_key in removed:
+                records.pop(record_key, None)
+            for theta in dirty:
+                if theta._record_key not in records and theta._record_key in self._known_records:
+                    # Removed by another instance, writing it would bring it back
+                    self._forget_theta(theta)
+                    continue
+                records[theta._record_key] = theta.export()
+            self._known_records = set(records)
+
+    async def _save_theta_edits(self) -> None:
+        """Save the streams a command added, removed or moved to other channels.
+
+        Other instances sharing the polling reload the records at their next
+        heartbeat when they see the new revision.
+        """
+        await self.save_theta()
+        synced = await self.db.records_revision() == self._records_revision
+        revision = uuid.uuid4().hex
+        await self.db.records_revision.set(revision)
+        # Otherwise another instance's changes are still to be picked up
+        if synced:
+            self._records_revision = revision
+
+    def _has_unsaved_changes(self) -> bool:
+        return bool(self._dirty_theta or self._removed_records or self._changed_theta_ids)
+
+    def _schedule_save(self) -> None:
+        """Save changed records after ``THETA_SAVE_DELAY`` seconds, coalescing any
+        changes made in the meantime into the same write."""
+        if self._save_task is None:
+            self._save_task = asyncio.ensure_future(self._delayed_save())
+
+    async def _delayed_save(self) -> None:
+        await asyncio.sleep(THETA_SAVE_DELAY)
+        self._save_task = None
+        try:
+            await self.save_theta()
+        except Exception as error:
+            log.exception("Failed to save Theta stream records:", exc_info=error)
 
     def cog_unload(self):
         if self.task:
             self.task.cancel()
+        if self._save_task is not None:
+            # Write pending changes now instead of after the debounce delay
+            self._save_task.cancel()
+            self._save_task = None
+            if self._has_unsaved_changes():
+                self.bot.loop.create_task(self.save_theta())
+        self._dispatcher.close()
+        self._token_manager.close()
+        if self._metrics_server.port:
+            self.bot.loop.create_task(self._metrics_server.close())
+        if self._webhook is not None and self._webhook.port:
+            self.bot.loop.create_task(self._webhook.close())
+        if self._shard is not None:
+            self.bot.loop.create_task(self._stop_sharding())
+        if self._poll_worker is not None:
+            self.bot.loop.create_task(self._stop_poll_worker())
+        if self._session is not None and not self._session.closed:
+            self.bot.loop.create_task(self._session.close())
 
     __del__ = cog_unload
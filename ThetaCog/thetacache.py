@@ -0,0 +1,65 @@
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+# How long each kind of stream metadata stays fresh, in seconds.
+DEFAULT_TTLS = {
+    "game": 3600,
+    "followers": 600,
+    "profile": 1800,
+}
+DEFAULT_MAXSIZE = 50000
+
+
+class MetadataCache:
+    """An LRU cache for slowly changing stream metadata.
+
+    Entries are keyed by ``(field, key)`` and expire after the TTL configured for
+    their field. Once ``maxsize`` entries are stored, the least recently used one
+    is evicted to make room.
+    """
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None, maxsize: int = DEFAULT_MAXSIZE):
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[float, Any]]" = OrderedDict()
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self.evictions = 0
+
+    def get(self, field: str, key: Hashable) -> Any:
+        """Returns the cached value, or ``None`` if it is missing or expired."""
+        entry = self._entries.get((field, key))
+        if entry is None:
+            self.misses[field] += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[(field, key)]
+            self.misses[field] += 1
+            return None
+        self._entries.move_to_end((field, key))
+        self.hits[field] += 1
+        return value
+
+    def set(self, field: str, key: Hashable, value: Any) -> None:
+        if value is None:
+            return
+        self._entries[(field, key)] = (time.monotonic() + self.ttls[field], value)
+        self._entries.move_to_end((field, key))
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, field: str, key: Hashable) -> None:
+        self._entries.pop((field, key), None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def hit_rate(self) -> float:
+        total = sum(self.hits.values()) + sum(self.misses.values())
+        return sum(self.hits.values()) / total if total else 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
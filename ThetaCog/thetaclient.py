@@ -0,0 +1,334 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Mapping, Optional, Tuple
+
+import aiohttp
+
+from .thetaerrors import CircuitOpenError
+from .thetametrics import ThetaMetrics, endpoint_label
+from .thetatoken import ThetaTokenManager
+from .thetatrace import trace_phase
+
+log = logging.getLogger("red.core.cogs.Theta")
+
+# Client-side request budget, used until the API tells us its actual limits.
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 20
+# Requests kept in reserve below the quota the API reports.
+RATE_LIMIT_SAFETY_MARGIN = 5
+
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+# Consecutive failed requests after which the API is considered down.
+FAILURE_THRESHOLD = 10
+# How long requests are refused before a probe is let through, doubled after
+# every failed probe up to the maximum.
+RESET_TIMEOUT = 60
+MAX_RESET_TIMEOUT = 900
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_HALF_OPEN = "half-open"
+CIRCUIT_OPEN = "open"
+CIRCUIT_STATES = (CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN)
+
+
+def _header_number(headers: Mapping[str, str], *names: str) -> Optional[float]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Returns the delay requested by a ``Retry-After`` header, in seconds."""
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class TokenBucket:
+    """Paces requests so that the client stays just under the API's quota.
+
+    The refill rate starts at ``rate`` and is lowered whenever the API's
+    rate-limit headers say fewer requests are left until the window resets.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, capacity: float = DEFAULT_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every request for the given number of seconds."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Adjust the budget to the rate-limit headers of a response."""
+        remaining = _header_number(headers, "Ratelimit-Remaining", "X-RateLimit-Remaining")
+        reset = _header_number(headers, "Ratelimit-Reset", "X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        # The reset may be sent as a Unix timestamp or as seconds from now.
+        until_reset = max(reset - time.time() if reset > 1e9 else reset, 0.0)
+        budget = remaining - RATE_LIMIT_SAFETY_MARGIN
+        if budget <= 0:
+            self.pause(until_reset)
+            return
+        self._refill()
+        self._tokens = min(self._tokens, budget)
+        self.rate = min(self.max_rate, budget / until_reset) if until_reset else self.max_rate
+
+    @property
+    def paused(self) -> bool:
+        return time.monotonic() < self._paused_until
+
+
+class CircuitBreaker:
+    """Stops sending requests to the API while it is down.
+
+    After ``threshold`` consecutive failed requests the circuit opens and
+    requests fail right away with `CircuitOpenError`. Once the reset timeout
+    has passed, the next request is let through as a probe while the others
+    wait for its answer: the circuit closes if it succeeds and opens again for
+    twice as long if it fails. ``on_change`` is called with the previous and
+    the new state on every transition.
+    """
+
+    def __init__(
+        self,
+        threshold: int = FAILURE_THRESHOLD,
+        reset_timeout: float = RESET_TIMEOUT,
+        on_change: Optional[Callable[[str, str], None]] = None,
+    ):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self._timeout = reset_timeout
+        self._retry_at = 0.0
+        self._probe: Optional[asyncio.Future] = None
+        self._on_change = on_change
+
+    @property
+    def rejecting(self) -> bool:
+        """Whether requests are refused, with no probe due yet."""
+        return self.state == CIRCUIT_OPEN and time.monotonic() < self._retry_at
+
+    @property
+    def retry_in(self) -> float:
+        """Seconds until a probe is let through, while the circuit is open."""
+        if self.state != CIRCUIT_OPEN:
+            return 0.0
+        return max(self._retry_at - time.monotonic(), 0.0)
+
+    async def acquire(self) -> bool:
+        """Wait until a request may be sent, returns whether it is the probe.
+
+        Raises `CircuitOpenError` while the circuit is open.
+        """
+        while True:
+            if self.state == CIRCUIT_CLOSED:
+                return False
+            if self.state == CIRCUIT_OPEN:
+                if self.rejecting:
+                    raise CircuitOpenError()
+                self._probe = asyncio.get_running_loop().create_future()
+                self._set_state(CIRCUIT_HALF_OPEN)
+                return True
+            # Another request is probing, its answer decides what happens to this one
+            await asyncio.shield(self._probe)
+
+    def record_success(self) -> None:
+        self.failures = 0
+        if self.state != CIRCUIT_CLOSED:
+            self._timeout = self.reset_timeout
+            self._set_state(CIRCUIT_CLOSED)
+            self._release_waiters()
+
+    def record_failure(self, probe: bool = False) -> None:
+        self.failures += 1
+        if probe:
+            self._timeout = min(self._timeout * 2, MAX_RESET_TIMEOUT)
+            self._open()
+        elif self.state == CIRCUIT_CLOSED and self.failures >= self.threshold:
+            self._open()
+
+    def abandon_probe(self) -> None:
+        """Let the next request probe instead, this one was cancelled before an answer."""
+        if self.state == CIRCUIT_HALF_OPEN:
+            # Set first, so listeners see the circuit as ready to retry
+            self._retry_at = time.monotonic()
+            self._set_state(CIRCUIT_OPEN)
+            self._release_waiters()
+
+    def _open(self) -> None:
+        self._retry_at = time.monotonic() + self._timeout
+        self._set_state(CIRCUIT_OPEN)
+        self._release_waiters()
+
+    def _set_state(self, state: str) -> None:
+        previous, self.state = self.state, state
+        if previous != state:
+            log.debug("Theta API circuit went from %s to %s", previous, state)
+            if self._on_change is not None:
+                self._on_change(previous, state)
+
+    def _release_waiters(self) -> None:
+        if self._probe is not None and not self._probe.done():
+            self._probe.set_result(None)
+        self._probe = None
+
+
+class ThetaClient:
+    """Sends requests to the Theta API through the cog's shared session.
+
+    Every request waits for the token bucket. Idempotent requests are retried
+    with jittered exponential backoff on 429s, server errors and connection
+    failures. A 429 pauses all requests for as long as ``Retry-After`` asks.
+    When a token manager is given, its current bearer token is added to any
+    request headers that don't carry their own. When a circuit breaker is given,
+    requests that still fail after their retries count towards opening it.
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        bucket: Optional[TokenBucket] = None,
+        max_retries: int = MAX_RETRIES,
+        token_manager: Optional[ThetaTokenManager] = None,
+        metrics: Optional[ThetaMetrics] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self._session = session
+        self.bucket = bucket or TokenBucket()
+        self.max_retries = max_retries
+        self.token_manager = token_manager
+        self.metrics = metrics
+        self.breaker = breaker
+
+    async def request(self, method: str, url: str, **kwargs) -> Tuple[int, Any]:
+        """Returns a 2-tuple of the response status and the decoded JSON body.
+
+        The body is ``None`` when the response isn't valid JSON. Raises
+        `CircuitOpenError` without sending anything while the circuit is open.
+        """
+        if self.breaker is None:
+            return await self._request(method, url, **kwargs)
+        probe = await self.breaker.acquire()
+        try:
+            status, data = await self._request(method, url, **kwargs)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            self.breaker.record_failure(probe)
+            raise
+        except BaseException:
+            if probe:
+                self.breaker.abandon_probe()
+            raise
+        if status >= 500 or (status == 200 and data is None):
+            # Server errors and undecodable bodies, anything else means the API answered
+            self.breaker.record_failure(probe)
+        else:
+            self.breaker.record_success()
+        return status, data
+
+    async def _request(self, method: str, url: str, **kwargs) -> Tuple[int, Any]:
+        retries = self.max_retries if method in IDEMPOTENT_METHODS else 0
+        headers = kwargs.get("headers")
+        if headers is not None and "Authorization" not in headers and self.token_manager:
+            bearer = self.token_manager.bearer
+            if bearer:
+                kwargs["headers"] = {**headers, "Authorization": f"Bearer {bearer}"}
+        attempt = 0
+        while True:
+            with trace_phase("rate_limit"):
+                await self.bucket.acquire()
+            started = time.monotonic()
+            try:
+                with trace_phase("api"):
+                    async with self._session.request(method, url, **kwargs) as r:
+                        self.bucket.update(r.headers)
+                        status = r.status
+                        retry_after = parse_retry_after(r.headers)
+                        try:
+                            data = await r.json()
+                        except (aiohttp.ContentTypeError, json.JSONDecodeError):
+                            data = None
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self._record(url, "error", started)
+                if attempt >= retries:
+                    raise
+                with trace_phase("backoff"):
+                    await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+            self._record(url, str(status), started)
+
+            if status == 429:
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                log.debug("Theta API rate limited us, pausing requests for %.1fs", delay)
+                self.bucket.pause(delay)
+            if status not in RETRY_STATUSES or attempt >= retries:
+                return status, data
+            if status != 429:
+                with trace_phase("backoff"):
+                    await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    def _record(self, url: str, status: str, started: float) -> None:
+        if self.metrics is None:
+            return
+        endpoint = endpoint_label(url)
+        self.metrics.inc("theta_api_requests_total", endpoint=endpoint, status=status)
+        self.metrics.observe(
+            "theta_api_request_seconds", time.monotonic() - started, endpoint=endpoint
+        )
+
+    async def get_json(self, url: str, headers, params) -> Tuple[int, Any]:
+        return await self.request("GET", url, headers=headers, params=params)
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import discord
+
+from .thetametrics import ThetaMetrics
+
+log = logging.getLogger("red.core.cogs.Theta")
+
+# A guild's send worker exits after this many idle seconds.
+GUILD_QUEUE_IDLE_TIMEOUT = 300
+
+
+class AlertDispatcher:
+    """Delivers alert messages and edits through one send queue per guild.
+
+    Messages for the same guild are sent one after another, so a guild that is
+    being rate limited only slows itself down, while different guilds are served
+    concurrently.
+    """
+
+    def __init__(self, metrics: Optional[ThetaMetrics] = None):
+        self.metrics = metrics
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    async def send(
+        self,
+        channel: discord.TextChannel,
+        content: str,
+        *,
+        embed: Optional[discord.Embed] = None,
+        detected_at: Optional[float] = None,
+    ) -> discord.Message:
+        """Queue a message for the channel's guild and wait until it has been sent.
+
+        ``detected_at`` is the `time.monotonic` timestamp at which the stream was
+        seen going live, used to record the alert's delivery latency.
+        """
+        return await self._submit(
+            channel.guild.id, lambda: channel.send(content, embed=embed), detected_at
+        )
+
+    async def edit(self, message: discord.PartialMessage, *, embed: discord.Embed):
+        """Queue an embed edit of a posted alert and wait until it is done."""
+        return await self._submit(message.channel.guild.id, lambda: message.edit(embed=embed))
+
+    async def _submit(
+        self,
+        guild_id: int,
+        action: Callable[[], Awaitable],
+        detected_at: Optional[float] = None,
+    ):
+        future = asyncio.get_event_loop().create_future()
+        self._get_queue(guild_id).put_nowait((action, detected_at, future))
+        return await future
+
+    def _get_queue(self, guild_id: int) -> asyncio.Queue:
+        queue = self._queues.get(guild_id)
+        if queue is None:
+            queue = self._queues[guild_id] = asyncio.Queue()
+            self._workers[guild_id] = asyncio.ensure_future(self._worker(guild_id, queue))
+        return queue
+
+    async def _worker(self, guild_id: int, queue: asyncio.Queue) -> None:
+        while True:
+            try:
+                job = await asyncio.wait_for(queue.get(), GUILD_QUEUE_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    del self._queues[guild_id]
+                    del self._workers[guild_id]
+                    return
+                continue
+            action, detected_at, future = job
+            if future.cancelled():
+                continue
+            try:
+                result = await action()
+            except Exception as error:
+                if not future.cancelled():
+                    future.set_exception(error)
+                continue
+            if detected_at is not None:
+                latency = time.monotonic() - detected_at
+                if self.metrics is not None:
+                    self.metrics.observe("theta_alert_delivery_seconds", latency)
+                log.debug("Delivered Theta alert in guild %s in %.2fs", guild_id, latency)
+            if not future.cancelled():
+                future.set_result(result)
+
+    def close(self) -> None:
+        for worker in self._workers.values():
+            worker.cancel()
+        self._workers.clear()
+        self._queues.clear()
@@ -20,3 +20,11 @@ class InvalidThetaCredentials(ThetaError):
 
 class OfflineStream(ThetaError):
     pass
+
+
+class PollWorkerError(ThetaError):
+    pass
+
+
+class CircuitOpenError(StreamsError):
+    pass
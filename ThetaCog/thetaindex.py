@@ -0,0 +1,121 @@
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from .thetatypes import Theta
+
+
+class ThetaIndex:
+    """Hash indexes over the tracked streams.
+
+    Streams are keyed by lowercased name and by user ID, and reverse indexes map
+    each Discord channel to the streams alerting there and each guild to its
+    alerting channels. Every method is synchronous so the indexes can never be
+    observed half updated from another task.
+    """
+
+    def __init__(self, get_guild_id: Callable[[int], Optional[int]]):
+        self.by_name: Dict[str, Theta] = {}
+        self.by_id: Dict[str, Theta] = {}
+        self.by_channel: Dict[int, Set[Theta]] = {}
+        self._get_guild_id = get_guild_id
+        self._guild_channels: Dict[int, Set[int]] = {}
+        self._channel_guild: Dict[int, int] = {}
+        self._keys: Dict[Theta, Tuple[Optional[str], Optional[str]]] = {}
+
+    @staticmethod
+    def _keys_of(theta: Theta) -> Tuple[Optional[str], Optional[str]]:
+        name = theta.name.lower() if theta.name else None
+        return name, getattr(theta, "id", None)
+
+    def add(self, theta: Theta) -> None:
+        name, user_id = self._keys[theta] = self._keys_of(theta)
+        if name:
+            self.by_name[name] = theta
+        if user_id:
+            self.by_id[user_id] = theta
+        for channel_id in theta.channels:
+            self._link(theta, channel_id)
+
+    def remove(self, theta: Theta) -> None:
+        name, user_id = self._keys.pop(theta, (None, None))
+        if name and self.by_name.get(name) is theta:
+            del self.by_name[name]
+        if user_id and self.by_id.get(user_id) is theta:
+            del self.by_id[user_id]
+        for channel_id in theta.channels:
+            self._unlink(theta, channel_id)
+
+    def refresh(self, theta: Theta) -> bool:
+        """Re-key a stream whose name or ID changed since it was indexed.
+
+        Returns whether anything changed.
+        """
+        name, user_id = self._keys.get(theta, (None, None))
+        if theta not in self._keys or (name, user_id) == self._keys_of(theta):
+            return False
+        if name and self.by_name.get(name) is theta:
+            del self.by_name[name]
+        if user_id and self.by_id.get(user_id) is theta:
+            del self.by_id[user_id]
+        name, user_id = self._keys[theta] = self._keys_of(theta)
+        if name:
+            self.by_name[name] = theta
+        if user_id:
+            self.by_id[user_id] = theta
+        return True
+
+    def rebuild(self, streams: Iterable[Theta]) -> None:
+        self.by_name.clear()
+        self.by_id.clear()
+        self.by_channel.clear()
+        self._guild_channels.clear()
+        self._channel_guild.clear()
+        self._keys.clear()
+        for theta in streams:
+            self.add(theta)
+
+    def add_channel(self, theta: Theta, channel_id: int) -> None:
+        theta.channels.append(channel_id)
+        if theta in self._keys:
+            self._link(theta, channel_id)
+
+    def remove_channel(self, theta: Theta, channel_id: int) -> None:
+        theta.channels.remove(channel_id)
+        if theta in self._keys:
+            self._unlink(theta, channel_id)
+
+    def in_channel(self, channel_id: int) -> Set[Theta]:
+        return self.by_channel.get(channel_id, set())
+
+    def guild_channels(self, guild_id: int) -> Set[int]:
+        """Returns the IDs of the guild's channels that have at least one alert."""
+        return self._guild_channels.get(guild_id, set())
+
+    def _link(self, theta: Theta, channel_id: int) -> None:
+        self.by_channel.setdefault(channel_id, set()).add(theta)
+        if channel_id not in self._channel_guild:
+            guild_id = self._get_guild_id(channel_id)
+            if guild_id is None:
+                return
+            self._channel_guild[channel_id] = guild_id
+        self._guild_channels.setdefault(self._channel_guild[channel_id], set()).add(channel_id)
+
+    def _unlink(self, theta: Theta, channel_id: int) -> None:
+        streams = self.by_channel.get(channel_id)
+        if streams is None:
+            return
+        streams.discard(theta)
+        if streams:
+            return
+        del self.by_channel[channel_id]
+        guild_id = self._channel_guild.pop(channel_id, None)
+        if guild_id is not None:
+            channels = self._guild_channels[guild_id]
+            channels.discard(channel_id)
+            if not channels:
+                del self._guild_channels[guild_id]
+
+    def __contains__(self, theta: Theta) -> bool:
+        return theta in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
@@ -0,0 +1,227 @@
+import bisect
+import logging
+import math
+from collections import defaultdict
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from aiohttp import web
+from yarl import URL
+
+log = logging.getLogger("red.core.cogs.Theta")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, math.inf)
+CYCLE_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, math.inf)
+
+# name: (type, help text, histogram buckets)
+METRICS = {
+    "theta_api_requests_total": (
+        "counter",
+        "Theta API responses by endpoint and status code, 'error' for failed connections.",
+        None,
+    ),
+    "theta_api_request_seconds": ("histogram", "Theta API request latency.", LATENCY_BUCKETS),
+    "theta_api_circuit_state": (
+        "gauge",
+        "State of the Theta API circuit breaker: 0 closed, 1 half-open, 2 open.",
+        None,
+    ),
+    "theta_poll_cycle_seconds": ("histogram", "Duration of a poll cycle.", CYCLE_BUCKETS),
+    "theta_poll_cycles_skipped_total": (
+        "counter",
+        "Poll cycles skipped because the Theta API circuit was open.",
+        None,
+    ),
+    "theta_poll_cycle_streams": ("gauge", "Streams checked by the latest poll cycle.", None),
+    "theta_streams_checked_total": ("counter", "Streams checked by all poll cycles.", None),
+    "theta_stream_checks_total": ("counter", "Stream check outcomes.", None),
+    "theta_stream_check_errors_total": ("counter", "Stream checks that raised, by error.", None),
+    "theta_cache_hits_total": ("counter", "Metadata cache hits by field.", None),
+    "theta_cache_misses_total": ("counter", "Metadata cache misses by field.", None),
+    "theta_cache_entries": ("gauge", "Entries held by the metadata cache.", None),
+    "theta_webhook_events_total": ("counter", "Received webhook events by outcome.", None),
+    "theta_alert_delivery_seconds": (
+        "histogram",
+        "Time from detecting a stream going live to its alert being sent.",
+        LATENCY_BUCKETS,
+    ),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+@lru_cache(maxsize=64)
+def endpoint_label(url: str) -> str:
+    """The path of an API URL, without its query, for use as a metric label."""
+    return URL(url).path
+
+
+class Histogram:
+    """Counts observations into fixed buckets, like a Prometheus histogram."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram") -> None:
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                if math.isinf(upper):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return lower
+
+
+class ThetaMetrics:
+    """In-memory counters, gauges and histograms for the poll and alert pipelines.
+
+    Labels are passed as keyword arguments. Every metric must be declared in
+    ``METRICS``, which also decides how it is rendered.
+    """
+
+    def __init__(self):
+        self.values: Dict[str, Dict[Labels, float]] = defaultdict(dict)
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = defaultdict(dict)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        series = self.values[name]
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        self.values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        histogram = self.histograms[name].get(key)
+        if histogram is None:
+            histogram = self.histograms[name][key] = Histogram(METRICS[name][2])
+        histogram.observe(value)
+
+    def merge(self, other: "ThetaMetrics") -> None:
+        """Add the series recorded by another instance, e.g. in the poll worker process.
+
+        Counters and histograms are added up, gauges take the other instance's value.
+        """
+        for name, series in other.values.items():
+            own = self.values[name]
+            for labels, value in series.items():
+                if METRICS[name][0] == "counter":
+                    own[labels] = own.get(labels, 0) + value
+                else:
+                    own[labels] = value
+        for name, series in other.histograms.items():
+            for labels, histogram in series.items():
+                own = self.histograms[name].get(labels)
+                if own is None:
+                    self.histograms[name][labels] = histogram
+                else:
+                    own.merge(histogram)
+
+    def histogram(self, name: str, **labels: str) -> Optional[Histogram]:
+        return self.histograms.get(name, {}).get(tuple(sorted(labels.items())))
+
+    def render_prometheus(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        for name, (kind, help_text, _buckets) in METRICS.items():
+            if kind == "histogram":
+                series = self.histograms.get(name)
+            else:
+                series = self.values.get(name)
+            if not series:
+                continue
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for labels, value in sorted(series.items()):
+                if kind != "histogram":
+                    lines.append("{}{} {}".format(name, _format_labels(labels), _number(value)))
+                    continue
+                cumulative = 0
+                for upper, count in zip(value.buckets, value.counts):
+                    cumulative += count
+                    le = "+Inf" if math.isinf(upper) else _number(upper)
+                    lines.append(
+                        "{}_bucket{} {}".format(
+                            name, _format_labels(labels + (("le", le),)), cumulative
+                        )
+                    )
+                lines.append("{}_sum{} {}".format(name, _format_labels(labels), _number(value.sum)))
+                lines.append("{}_count{} {}".format(name, _format_labels(labels), value.count))
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(
+            key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsServer:
+    """Serves ``/metrics`` in the Prometheus text format on a local port."""
+
+    def __init__(self, render: Callable[[], str]):
+        self._render = render
+        self._runner: Optional[web.AppRunner] = None
+        self.port: Optional[int] = None
+
+    async def start(self, port: int, host: str = "127.0.0.1") -> None:
+        await self.close()
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+        except OSError:
+            await runner.cleanup()
+            raise
+        self._runner = runner
+        self.port = port
+        log.info("Serving Theta metrics on http://%s:%s/metrics", host, port)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self._render(), content_type="text/plain", charset="utf-8")
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+            self.port = None
@@ -0,0 +1,114 @@
+import heapq
+import itertools
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from .thetatypes import Theta
+
+# Streams seen live within this window are always polled at the base interval.
+RECENTLY_LIVE_WINDOW = 24 * 60 * 60
+# The polling interval of an offline stream doubles after this many offline checks...
+BACKOFF_STEP = 12
+# ...up to this multiple of the base refresh timer.
+MAX_BACKOFF_FACTOR = 8
+# Longest the poll loop sleeps before looking for due streams again.
+MAX_TICK = 10
+
+
+class ThetaScheduler:
+    """Keeps a next-check time for every tracked stream.
+
+    Streams that are live or were live recently are polled every ``refresh_timer``
+    seconds, streams that stay offline are polled less and less often, up to
+    ``MAX_BACKOFF_FACTOR`` times the refresh timer. Check times are spread across
+    the interval so a cycle never polls everything in one burst.
+    """
+
+    def __init__(self, refresh_timer: int):
+        self.refresh_timer = refresh_timer
+        self._next_check: Dict[Theta, float] = {}
+        self._last_live: Dict[Theta, float] = {}
+        self._misses: Dict[Theta, int] = {}
+        self._heap: List[Tuple[float, int, Theta]] = []
+        self._counter = itertools.count()
+
+    def interval(self, theta: Theta) -> float:
+        last_live = self._last_live.get(theta)
+        if last_live is not None and time.monotonic() - last_live < RECENTLY_LIVE_WINDOW:
+            return self.refresh_timer
+        factor = min(2 ** (self._misses.get(theta, 0) // BACKOFF_STEP), MAX_BACKOFF_FACTOR)
+        return self.refresh_timer * factor
+
+    def _push(self, theta: Theta, when: float) -> None:
+        self._next_check[theta] = when
+        heapq.heappush(self._heap, (when, next(self._counter), theta))
+
+    def add(self, theta: Theta) -> None:
+        """Schedule a newly tracked stream to be checked right away."""
+        self._push(theta, time.monotonic())
+
+    def remove(self, theta: Theta) -> None:
+        self._next_check.pop(theta, None)
+        self._last_live.pop(theta, None)
+        self._misses.pop(theta, None)
+
+    def rebuild(self, streams: Iterable[Theta]) -> None:
+        """Forget all state and spread the given streams evenly over one interval."""
+        streams = list(streams)
+        self._next_check.clear()
+        self._last_live.clear()
+        self._misses.clear()
+        self._heap.clear()
+        now = time.monotonic()
+        for position, theta in enumerate(streams):
+            self._push(theta, now + self.refresh_timer * position / len(streams))
+
+    def due(self) -> List[Theta]:
+        """Pop every stream whose check is due and provisionally schedule its next one."""
+        now = time.monotonic()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, _, theta = heapq.heappop(self._heap)
+            if self._next_check.get(theta) != when:
+                # Rescheduled or removed since this entry was pushed
+                continue
+            due.append(theta)
+            self._push(theta, now + self.interval(theta))
+        return due
+
+    def mark_live(self, theta: Theta) -> None:
+        if theta not in self._next_check:
+            return
+        self._last_live[theta] = time.monotonic()
+        self._misses[theta] = 0
+        self._push(theta, time.monotonic() + self.interval(theta))
+
+    def mark_offline(self, theta: Theta) -> None:
+        if theta not in self._next_check:
+            return
+        self._misses[theta] = self._misses.get(theta, 0) + 1
+        self._push(theta, time.monotonic() + self.interval(theta))
+
+    def seconds_until_next(self) -> float:
+        """How long the poll loop may sleep before the next stream is due."""
+        if not self._next_check:
+            return MAX_TICK
+        while self._heap and self._next_check.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return MAX_TICK
+        return min(max(self._heap[0][0] - time.monotonic(), 1), MAX_TICK)
+
+    def schedule(self) -> List[Tuple[Theta, float, float]]:
+        """Returns ``(stream, seconds until next check, interval)`` sorted by due time."""
+        now = time.monotonic()
+        return sorted(
+            (
+                (theta, max(when - now, 0), self.interval(theta))
+                for theta, when in self._next_check.items()
+            ),
+            key=lambda item: item[1],
+        )
+
+    def __len__(self) -> int:
+        return len(self._next_check)
@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, FrozenSet, List, Optional
+
+log = logging.getLogger("red.core.cogs.Theta")
+
+# How often each instance writes its heartbeat and looks for other instances.
+HEARTBEAT_INTERVAL = 15
+# An instance that hasn't written a heartbeat for this long is considered gone.
+HEARTBEAT_TIMEOUT = 60
+HEARTBEAT_SUFFIX = ".heartbeat"
+
+
+def _score(instance: str, key: str) -> int:
+    digest = hashlib.blake2b("{}\0{}".format(instance, key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def rendezvous_owner(instances: FrozenSet[str], key: str) -> Optional[str]:
+    """Returns the instance with the highest hash score for ``key``.
+
+    Every instance computes the same owner from the same membership, and when an
+    instance leaves only the keys it owned move elsewhere.
+    """
+    if not instances:
+        return None
+    return max(instances, key=lambda instance: (_score(instance, key), instance))
+
+
+class ShardCoordinator:
+    """Splits the tracked streams between bot instances sharing a directory.
+
+    Each instance regularly writes a heartbeat file to ``directory``, and the
+    instances whose heartbeat is recent enough form the membership. Each stream
+    is owned by one member, chosen by rendezvous hashing of its Theta user ID,
+    and only its owner polls it. ``on_beat`` is awaited after every heartbeat
+    with the previous membership if it changed, ``None`` otherwise.
+
+    Heartbeats carry the value returned by ``fingerprint``, instances whose
+    fingerprint differs from this one's are listed by `mismatched`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        instance: str,
+        on_beat: Optional[Callable[[Optional[FrozenSet[str]]], Awaitable[None]]] = None,
+        interval: float = HEARTBEAT_INTERVAL,
+        timeout: float = HEARTBEAT_TIMEOUT,
+        fingerprint: Optional[Callable[[], Optional[str]]] = None,
+    ):
+        self.directory = directory
+        self.instance = instance
+        self.interval = interval
+        self.timeout = timeout
+        self.members: FrozenSet[str] = frozenset({instance})
+        self._on_beat = on_beat
+        self._fingerprint = fingerprint
+        self._fingerprints: Dict[str, Optional[str]] = {}
+        self._owners: Dict[str, Optional[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def _heartbeat_path(self) -> str:
+        return os.path.join(self.directory, self.instance + HEARTBEAT_SUFFIX)
+
+    def owns(self, key: Optional[str]) -> bool:
+        """Whether this instance should poll the stream with the given key."""
+        if key is None:
+            return True
+        owner = self._owners.get(key)
+        if owner is None:
+            owner = self._owners[key] = rendezvous_owner(self.members, key)
+        return owner == self.instance
+
+    def mismatched(self) -> List[str]:
+        """Members whose last heartbeat carried a different fingerprint than this instance's."""
+        own = self._fingerprints.get(self.instance)
+        return sorted(
+            member
+            for member in self.members
+            if member != self.instance and self._fingerprints.get(member) != own
+        )
+
+    def _write_heartbeat(self, fingerprint: Optional[str]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self._heartbeat_path + ".tmp"
+        with open(temporary, "w") as fp:
+            json.dump(
+                {"instance": self.instance, "time": time.time(), "fingerprint": fingerprint}, fp
+            )
+        # Atomic, so readers never see a half written heartbeat
+        os.replace(temporary, self._heartbeat_path)
+
+    def _read_members(self) -> Dict[str, Optional[str]]:
+        """Returns the fingerprint of each member by name."""
+        now = time.time()
+        members = {}
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(HEARTBEAT_SUFFIX):
+                continue
+            try:
+                with open(entry.path) as fp:
+                    heartbeat = json.load(fp)
+            except (OSError, ValueError):
+                continue
+            if now - heartbeat.get("time", 0) <= self.timeout:
+                instance = heartbeat.get("instance", entry.name[: -len(HEARTBEAT_SUFFIX)])
+                members[instance] = heartbeat.get("fingerprint")
+        return members
+
+    async def beat(self) -> Optional[FrozenSet[str]]:
+        """Write this instance's heartbeat and refresh the membership.
+
+        Returns the previous membership if it changed, ``None`` otherwise.
+        """
+        loop = asyncio.get_event_loop()
+        fingerprint = self._fingerprint() if self._fingerprint is not None else None
+        # The directory may be on a network share, keep its latency off the event loop
+        await loop.run_in_executor(None, self._write_heartbeat, fingerprint)
+        self._fingerprints = await loop.run_in_executor(None, self._read_members)
+        self._fingerprints[self.instance] = fingerprint
+        members = frozenset(self._fingerprints)
+        if members == self.members:
+            return None
+        log.info(
+            "Theta shard membership changed from %s to %s",
+            sorted(self.members),
+            sorted(members),
+        )
+        previous, self.members = self.members, members
+        self._owners.clear()
+        return previous
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                previous = await self.beat()
+                if self._on_beat is not None:
+                    await self._on_beat(previous)
+            except Exception as error:
+                log.exception("Theta shard heartbeat failed", exc_info=error)
+            await asyncio.sleep(self.interval)
+
+    async def close(self) -> None:
+        """Stop heartbeating and remove this instance's heartbeat so others take over now."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, os.remove, self._heartbeat_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+log = logging.getLogger("red.core.cogs.Theta")
+
+# A token is renewed once this fraction of its lifetime has passed...
+REFRESH_AT_FRACTION = 0.75
+# ...but never later than this many seconds before it expires.
+REFRESH_MARGIN = 300
+# How long to wait before trying again after a failed request, doubled after each failure...
+REFRESH_RETRY_DELAY = 60
+# ...up to this. Also how often to look again when the token never expires.
+IDLE_RECHECK_DELAY = 3600
+
+
+class ThetaTokenManager:
+    """Keeps the Theta bearer token fresh in the background.
+
+    ``fetch`` requests a new token and returns the OAuth2 response body, or
+    ``None`` when the request failed. The first token is requested as soon as
+    the manager starts, and again after failures until one is issued. Readers
+    get the cached token through `bearer` without awaiting anything, and
+    concurrent calls to `refresh` share a single request.
+    """
+
+    def __init__(self, fetch: Callable[[], Awaitable[Optional[dict]]]):
+        self._fetch = fetch
+        self.token: dict = {}
+        self._issued_at = 0.0
+        self._refresh: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+        self._renewed = asyncio.Event()
+
+    @property
+    def bearer(self) -> Optional[str]:
+        return self.token.get("access_token")
+
+    @property
+    def expires_at(self) -> Optional[float]:
+        return self.token.get("expires_at")
+
+    def is_fresh(self) -> bool:
+        """Whether there is a token that is not about to expire."""
+        if not self.bearer:
+            return False
+        return self.expires_at is None or self.expires_at - time.time() > REFRESH_MARGIN
+
+    async def refresh(self) -> dict:
+        """Request a new token, joining the request already in flight if there is one."""
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.ensure_future(self._do_refresh())
+        # Shielded so a cancelled caller doesn't abort the request for everyone else
+        return await asyncio.shield(self._refresh)
+
+    async def ensure_fresh(self) -> None:
+        """Refresh the token if it is about to expire.
+
+        This only matters when the background refresh has been failing, otherwise
+        the token is always fresh and this returns right away.
+        """
+        if self.bearer and not self.is_fresh():
+            await self.refresh()
+
+    async def _do_refresh(self) -> dict:
+        data = await self._fetch()
+        if data:
+            now = time.time()
+            expires_in = data.get("expires_in")
+            if expires_in:
+                data["expires_at"] = now + expires_in
+            self._issued_at = now
+            self.token = data
+            # Wake the background task so it schedules the next renewal from this token
+            self._renewed.set()
+        return self.token
+
+    def _seconds_until_refresh(self) -> float:
+        if not self.bearer:
+            return 0
+        if self.expires_at is None:
+            return IDLE_RECHECK_DELAY
+        lifetime = self.expires_at - self._issued_at
+        refresh_at = min(
+            self._issued_at + lifetime * REFRESH_AT_FRACTION, self.expires_at - REFRESH_MARGIN
+        )
+        return max(refresh_at - time.time(), 0)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        retry_delay = REFRESH_RETRY_DELAY
+        while True:
+            self._renewed.clear()
+            try:
+                await asyncio.wait_for(self._renewed.wait(), self._seconds_until_refresh())
+                continue
+            except asyncio.TimeoutError:
+                pass
+            previous = self.bearer
+            try:
+                await self.refresh()
+            except Exception as error:
+                log.exception("Failed to renew the Theta bearer token", exc_info=error)
+            if self.bearer != previous:
+                retry_delay = REFRESH_RETRY_DELAY
+                continue
+            # Missing or wrong credentials fail every time, don't keep hammering the API
+            try:
+                await asyncio.wait_for(self._renewed.wait(), retry_delay)
+            except asyncio.TimeoutError:
+                pass
+            retry_delay = min(retry_delay * 2, IDLE_RECHECK_DELAY)
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,163 @@
+import cProfile
+import heapq
+import io
+import itertools
+import logging
+import pstats
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, List, Optional, Tuple, Union
+
+log = logging.getLogger("red.core.cogs.Theta")
+
+# How many of the slowest poll cycles are kept.
+SLOWEST_CYCLES = 10
+# How many of its slowest stream checks are kept with each cycle.
+SLOWEST_STREAMS = 10
+# How many profiler captures are kept, and how many functions each one lists.
+PROFILE_CAPTURES = 5
+PROFILE_LINES = 30
+
+_current: ContextVar[Optional[Union["CycleTrace", "StreamTrace"]]] = ContextVar(
+    "theta_trace", default=None
+)
+
+
+class StreamTrace:
+    """Time spent in each phase of a single stream check."""
+
+    __slots__ = ("id", "stream", "duration", "phases")
+
+    def __init__(self, trace_id: str, stream: str):
+        self.id = trace_id
+        self.stream = stream
+        self.duration = 0.0
+        self.phases: Dict[str, float] = {}
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+class CycleTrace:
+    """Time spent in each phase of a poll cycle, summed over its stream checks."""
+
+    __slots__ = ("id", "started_at", "duration", "streams", "phases", "stream_traces", "_counter")
+
+    def __init__(self, trace_id: str, streams: int):
+        self.id = trace_id
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.streams = streams
+        self.phases: Dict[str, float] = {}
+        self.stream_traces: List[StreamTrace] = []
+        self._counter = itertools.count(1)
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def new_stream(self, stream: str) -> StreamTrace:
+        trace = StreamTrace("{}-{}".format(self.id, next(self._counter)), stream)
+        self.stream_traces.append(trace)
+        return trace
+
+
+@contextmanager
+def trace_phase(phase: str) -> Iterator[None]:
+    """Attribute the time spent in the block to ``phase`` of the current trace, if any."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(phase, time.perf_counter() - started)
+
+
+class ThetaTracer:
+    """Optional tracing of poll cycles.
+
+    While enabled, every cycle and every stream check in it gets an ID and the
+    time spent in each phase is recorded. Only the ``keep`` slowest cycles are
+    retained. Independently of tracing, the next few cycles can be run under
+    `cProfile`.
+    """
+
+    def __init__(self, keep: int = SLOWEST_CYCLES):
+        self.enabled = False
+        self.keep = keep
+        self._slowest: List[Tuple[float, int, CycleTrace]] = []
+        self._cycle_ids = itertools.count(1)
+        self.profile_cycles = 0
+        self.profiles: Deque[Tuple[str, float, str]] = deque(maxlen=PROFILE_CAPTURES)
+
+    def start_cycle(self, streams: int) -> Optional[CycleTrace]:
+        """Start tracing a cycle, returns ``None`` when tracing is disabled."""
+        if not self.enabled:
+            return None
+        trace = CycleTrace("c{}".format(next(self._cycle_ids)), streams)
+        _current.set(trace)
+        return trace
+
+    def finish_cycle(self, trace: Optional[CycleTrace], duration: float) -> None:
+        if trace is None:
+            return
+        _current.set(None)
+        trace.duration = duration
+        for stream_trace in trace.stream_traces:
+            for phase, seconds in stream_trace.phases.items():
+                trace.add(phase, seconds)
+        trace.stream_traces = heapq.nlargest(
+            SLOWEST_STREAMS, trace.stream_traces, key=lambda stream: stream.duration
+        )
+        log.debug(
+            "Theta poll cycle %s checked %d streams in %.2fs", trace.id, trace.streams, duration
+        )
+        entry = (duration, int(trace.id[1:]), trace)
+        if len(self._slowest) < self.keep:
+            heapq.heappush(self._slowest, entry)
+        elif duration > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    @contextmanager
+    def stream(self, cycle: Optional[CycleTrace], name: str) -> Iterator[Optional[StreamTrace]]:
+        """Trace the stream check run inside the block as part of ``cycle``."""
+        if cycle is None:
+            yield None
+            return
+        trace = cycle.new_stream(name)
+        token = _current.set(trace)
+        started = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - started
+            _current.reset(token)
+
+    def slowest(self) -> List[CycleTrace]:
+        """Returns the retained cycles, slowest first."""
+        return [trace for _duration, _id, trace in sorted(self._slowest, reverse=True)]
+
+    def clear(self) -> None:
+        self._slowest.clear()
+
+    def start_profile(self) -> Optional[cProfile.Profile]:
+        """Start profiling a cycle if captures were requested."""
+        if not self.profile_cycles:
+            return None
+        self.profile_cycles -= 1
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def finish_profile(self, profiler: Optional[cProfile.Profile], label: str) -> None:
+        if profiler is None:
+            return
+        profiler.disable()
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(PROFILE_LINES)
+        self.profiles.append((label, time.time(), output.getvalue()))
@@ -1,13 +1,18 @@
+import asyncio
 import json
 import logging
+import sys
+import time
 from random import choice
 from string import ascii_letters
 import xml.etree.ElementTree as ET
-from typing import ClassVar, Optional, List
+from typing import ClassVar, Dict, Optional, List, Tuple
 
-import aiohttp
 import discord
 
+from .thetacache import MetadataCache
+from .thetaclient import ThetaClient
+from .thetatrace import trace_phase
 from .thetaerrors import (
     APIError,
     OfflineStream,
@@ -21,26 +26,129 @@ THETA_BASE_URL = "https://api.theta.tv/v1"
 THETA_ID_ENDPOINT = THETA_BASE_URL + "/user/{{user_id}}"
 THETA_STREAMS_ENDPOINT = THETA_BASE_URL + "/theta/live/{{video_id}}"
 
+# How many user IDs are sent per batched live-status request.
+THETA_STREAMS_BATCH_SIZE = 100
+# How long to stick to per-ID lookups after the API rejected a batched request.
+THETA_BATCH_RETRY_INTERVAL = 3600
+
 _ = Translator("Streams", __file__)
 
 log = logging.getLogger("redbot.cogs.Theta")
 
 
-def rnd(url):
-    """Appends a random parameter to the url to avoid Discord's caching"""
+# Relative change in follower or view count that warrants editing a live alert.
+SIGNIFICANT_COUNT_CHANGE = 0.05
+
+
+def rnd(url, epoch: Optional[int] = None):
+    """Appends a cache-busting parameter to the url to avoid Discord's caching.
+
+    When ``epoch`` is given the parameter is derived from it, so every embed built
+    during the same poll epoch points at the same proxied image.
+    """
+    if epoch is not None:
+        return url + "?rnd=" + str(epoch)
     return url + "?rnd=" + "".join([choice(ascii_letters) for _loop_counter in range(6)])
 
 
+def get_headers(client_id, bearer=None) -> Dict[str, str]:
+    header = {"client-_id": str(client_id)}
+    if bearer is not None:
+        header = {**header, "Authorization": f"Bearer {bearer}"}
+    return header
+
+
+class ThetaStatusBatcher:
+    """Looks up the live status of many Theta users in as few requests as possible."""
+
+    def __init__(self, client: ThetaClient, batch_size: int = THETA_STREAMS_BATCH_SIZE):
+        self._client = client
+        self.batch_size = batch_size
+        self._disabled_until = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return time.monotonic() >= self._disabled_until
+
+    async def fetch(self, headers: Dict[str, str], user_ids: List[str]) -> Dict[str, dict]:
+        """Returns a mapping of user ID to a ``THETA_STREAMS_ENDPOINT``-shaped response.
+
+        Users missing from a batched response are looked up one at a time, as
+        the response may have been cut short. IDs whose lookup failed are left
+        out, so their streams fall back to querying the API on their own.
+        """
+        if not self.enabled or len(user_ids) < 2:
+            return {}
+        chunks = [
+            user_ids[i : i + self.batch_size] for i in range(0, len(user_ids), self.batch_size)
+        ]
+        results = await asyncio.gather(
+            *(self._fetch_chunk(headers, chunk) for chunk in chunks), return_exceptions=True
+        )
+        statuses = {}
+        for result in results:
+            if isinstance(result, dict):
+                statuses.update(result)
+        return statuses
+
+    async def _fetch_chunk(self, headers: Dict[str, str], user_ids: List[str]) -> Dict[str, dict]:
+        params = [("user_id", user_id) for user_id in user_ids]
+        status, data = await self._client.get_json(THETA_STREAMS_ENDPOINT, headers, params)
+        if status == 400 and len(user_ids) > 1:
+            log.debug("Theta API rejected a batched status request, falling back to single IDs.")
+            self._disabled_until = time.monotonic() + THETA_BATCH_RETRY_INTERVAL
+            return {}
+        if status != 200 or not isinstance(data, dict) or not isinstance(data.get("data"), list):
+            return {}
+        if len(user_ids) == 1:
+            return {user_ids[0]: data}
+        requested = set(user_ids)
+        found = {}
+        for entry in data["data"]:
+            if not isinstance(entry, dict):
+                continue
+            user_id = str(entry.get("user_id"))
+            if user_id in requested:
+                found[user_id] = {"data": [entry]}
+        # A missing user is not necessarily offline, the response may be a truncated page or
+        # the API may only honour one ID per request
+        missing = [user_id for user_id in user_ids if user_id not in found]
+        results = await asyncio.gather(
+            *(self._fetch_chunk(headers, [user_id]) for user_id in missing),
+            return_exceptions=True,
+        )
+        for result in results:
+            if not isinstance(result, dict):
+                continue
+            found.update(result)
+            if any(status["data"] for status in result.values()):
+                log.debug("Theta API left a live user out of a batch, falling back to single IDs.")
+                self._disabled_until = time.monotonic() + THETA_BATCH_RETRY_INTERVAL
+        return found
+
+
 class Theta:
 
+    __slots__ = ("name", "channels", "_messages_cache", "_record_key")
+
     token_name: ClassVar[Optional[str]] = None
+    # Attributes written to Config by `export`, in this order.
+    exported_fields: ClassVar[Tuple[str, ...]] = ("name", "channels", "type")
+    # Attributes pointing at objects shared with the cog, left out of `footprint`.
+    shared_fields: ClassVar[Tuple[str, ...]] = ()
 
     def __init__(self, **kwargs):
         self.name = kwargs.pop("name", None)
         self.channels = kwargs.pop("channels", [])
         # self.already_online = kwargs.pop("already_online", False)
-        self._messages_cache = kwargs.pop("_messages_cache", [])
-        self.type = self.__class__.__name__
+        # (channel ID, message ID) pairs of the alerts currently posted for this stream
+        self._messages_cache: List[Tuple[int, int]] = kwargs.pop("_messages_cache", [])
+        # Identifier of this stream's Config record, assigned when it is first tracked
+        self._record_key = kwargs.pop("_record_key", None)
+
+    @property
+    def type(self) -> str:
+        return self.__class__.__name__
 
     async def is_online(self):
         raise NotImplementedError()
@@ -49,42 +157,72 @@ class Theta:
         raise NotImplementedError()
 
     def export(self):
-        data = {}
-        for k, v in self.__dict__.items():
-            if not k.startswith("_"):
-                data[k] = v
+        data = {k: getattr(self, k) for k in self.exported_fields}
         data["messages"] = []
-        for m in self._messages_cache:
-            data["messages"].append({"channel": m.channel.id, "message": m.id})
+        for channel_id, message_id in self._messages_cache:
+            data["messages"].append({"channel": channel_id, "message": message_id})
         return data
 
+    def footprint(self) -> int:
+        """Approximate number of bytes held by this stream, excluding shared objects."""
+        size = sys.getsizeof(self)
+        for cls in type(self).__mro__:
+            for attr in getattr(cls, "__slots__", ()):
+                if attr in self.shared_fields:
+                    continue
+                value = getattr(self, attr, None)
+                size += sys.getsizeof(value)
+                if isinstance(value, list):
+                    size += sum(sys.getsizeof(item) for item in value)
+        return size
+
     def __repr__(self):
         return "<{0.__class__.__name__}: {0.name}>".format(self)
 
 class ThetaStream(Theta):
 
+    __slots__ = (
+        "id",
+        "_client_id",
+        "_bearer",
+        "_client",
+        "_cache",
+        "_embed_state",
+        "_posted_state",
+    )
+
     token_name = "theta"
+    exported_fields = ("id", "name", "channels", "type")
+    shared_fields = ("_client", "_cache")
 
     def __init__(self, **kwargs):
         self.id = kwargs.pop("id", None)
         self._client_id = kwargs.pop("token", None)
         self._bearer = kwargs.pop("bearer", None)
+        self._client: ThetaClient = kwargs.pop("client")
+        self._cache: MetadataCache = kwargs.pop("cache")
+        # Fields shown in the latest embed, and in the one currently posted in alerts
+        self._embed_state: Optional[tuple] = None
+        self._posted_state: Optional[tuple] = None
         super().__init__(**kwargs)
 
-    async def is_online(self):
+    async def is_online(self, prefetched: Optional[dict] = None, epoch: Optional[int] = None):
+        """Check whether the stream is live.
+
+        ``prefetched`` may hold this user's entry from a `ThetaStatusBatcher`
+        lookup, in which case the live-status request is skipped. ``epoch`` is
+        passed on to `make_embed`.
+        """
         if not self.id:
             self.id = await self.fetch_id()
 
-        url = THETA_STREAMS_ENDPOINT
-        header = {"client-_id": str(self._client_id)}
-        if self._bearer is not None:
-            header = {**header, "Authorization": f"Bearer {self._bearer}"}
-        params = {"user_id": self.id}
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=header, params=params) as r:
-                data = await r.json(encoding="utf-8")
-        if r.status == 200:
+        header = get_headers(self._client_id, self._bearer)
+        if prefetched is not None:
+            status, data = 200, prefetched
+        else:
+            params = {"user_id": self.id}
+            status, data = await self._client.get_json(THETA_STREAMS_ENDPOINT, header, params)
+        if status == 200:
             if not data["data"]:
                 raise OfflineStream()
             self.name = data["data"][0]["user_name"]
@@ -96,69 +234,81 @@ class ThetaStream(Theta):
 
             game_id = data["game_id"]
             if game_id:
-                params = {"id": game_id}
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(
-                        "https://api.theta.tv/v1/user", headers=header, params=params
-                    ) as r:
-                        game_data = await r.json(encoding="utf-8")
-                if game_data:
-                    game_data = game_data["data"][0]
-                    data["game_name"] = game_data["name"]
-            params = {"to_id": self.id}
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    "https://api.theta.tv/v1/channel/{{channel_id}}/channel_action", headers=header, params=params
-                ) as r:
-                    user_data = await r.json(encoding="utf-8")
-            if user_data:
-                followers = user_data["total"]
-                data["followers"] = followers
-
-            params = {"id": self.id}
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    "https://api.theta.tv/v1/user", headers=header, params=params
-                ) as r:
-                    user_profile_data = await r.json(encoding="utf-8")
-            if user_profile_data:
-                profile_image_url = user_profile_data["data"][0]["profile_image_url"]
-                data["profile_image_url"] = profile_image_url
-                data["view_count"] = user_profile_data["data"][0]["view_count"]
+                data["game_name"] = self._cache.get("game", game_id)
+                if data["game_name"] is None:
+                    params = {"id": game_id}
+                    status, game_data = await self._client.get_json(
+                        "https://api.theta.tv/v1/user", header, params
+                    )
+                    if status == 200 and game_data:
+                        game_data = game_data["data"][0]
+                        data["game_name"] = game_data["name"]
+                        self._cache.set("game", game_id, data["game_name"])
+
+            data["followers"] = self._cache.get("followers", self.id)
+            if data["followers"] is None:
+                params = {"to_id": self.id}
+                status, user_data = await self._client.get_json(
+                    "https://api.theta.tv/v1/channel/{{channel_id}}/channel_action", header, params
+                )
+                if status == 200 and user_data:
+                    data["followers"] = user_data["total"]
+                    self._cache.set("followers", self.id, data["followers"])
+
+            profile = self._cache.get("profile", self.id)
+            if profile is None:
+                params = {"id": self.id}
+                status, user_profile_data = await self._client.get_json(
+                    "https://api.theta.tv/v1/user", header, params
+                )
+                if status == 200 and user_profile_data:
+                    user_profile_data = user_profile_data["data"][0]
+                    profile = (
+                        user_profile_data["profile_image_url"],
+                        user_profile_data["view_count"],
+                    )
+                    self._cache.set("profile", self.id, profile)
+            if profile is not None:
+                data["profile_image_url"], data["view_count"] = profile
 
             is_rerun = False
-            return self.make_embed(data), is_rerun
-        elif r.status == 400:
+            with trace_phase("make_embed"):
+                embed = self.make_embed(data, epoch)
+            return embed, is_rerun
+        elif status == 400:
             raise InvalidThetaCredentials()
-        elif r.status == 404:
+        elif status == 404:
             raise StreamNotFound()
         else:
             raise APIError()
 
     async def fetch_id(self):
-        header = {"client-_id": str(self._client_id)}
-        if self._bearer is not None:
-            header = {**header, "Authorization": f"Bearer {self._bearer}"}
+        header = get_headers(self._client_id, self._bearer)
         url = THETA_ID_ENDPOINT
         params = {"login": self.name}
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=header, params=params) as r:
-                data = await r.json()
+        status, data = await self._client.get_json(url, header, params)
 
-        if r.status == 200:
+        if status == 200:
             if not data["data"]:
                 raise StreamNotFound()
             return data["data"][0]["id"]
-        elif r.status == 400:
+        elif status == 400:
             raise StreamNotFound()
-        elif r.status == 401:
+        elif status == 401:
             raise InvalidThetaCredentials()
         else:
             raise APIError()
 
-    def make_embed(self, data):
+    def make_embed(self, data, epoch: Optional[int] = None):
         is_rerun = data["type"] == "rerun"
+        self._embed_state = (
+            data["title"],
+            data["game_name"],
+            is_rerun,
+            data["followers"],
+            data["view_count"],
+        )
         url = f"https://www.theta.tv/{data['user_name']}"
         logo = data["profile_image_url"]
         if logo is None:
@@ -174,10 +324,29 @@ class ThetaStream(Theta):
         embed.add_field(name=_("Total views"), value=humanize_number(data["view_count"]))
         embed.set_thumbnail(url=logo)
         if data["thumbnail_url"]:
-            embed.set_image(url=rnd(data["thumbnail_url"].format(width=320, height=180)))
+            embed.set_image(url=rnd(data["thumbnail_url"].format(width=320, height=180), epoch))
         if data["game_name"]:
             embed.set_footer(text=_("Playing: ") + data["game_name"])
         return embed
 
+    def embed_changed(self) -> bool:
+        """Whether the latest embed differs enough from the posted one to edit alerts.
+
+        Title, game and rerun changes always count, follower and view counts only
+        once they moved by more than ``SIGNIFICANT_COUNT_CHANGE``.
+        """
+        old, new = self._posted_state, self._embed_state
+        if old is None or new is None:
+            return False
+        if old[:3] != new[:3]:
+            return True
+        for old_count, new_count in zip(old[3:], new[3:]):
+            if old_count is None or new_count is None:
+                if old_count != new_count:
+                    return True
+            elif abs(new_count - old_count) > abs(old_count) * SIGNIFICANT_COUNT_CHANGE:
+                return True
+        return False
+
     def __repr__(self):
         return "<{0.__class__.__name__}: {0.name} (ID: {0.id})>".format(self)
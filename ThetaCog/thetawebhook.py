@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+
+from .thetametrics import ThetaMetrics
+
+log = logging.getLogger("red.core.cogs.Theta")
+
+WEBHOOK_PATH = "/theta/events"
+SIGNATURE_HEADER = "X-Theta-Signature"
+TIMESTAMP_HEADER = "X-Theta-Timestamp"
+# Events signed longer ago than this are rejected, so captured requests can't be replayed.
+MAX_TIMESTAMP_SKEW = 300
+# How many event IDs are remembered to drop redelivered events.
+SEEN_EVENTS = 1024
+MAX_BODY_SIZE = 64 * 1024
+
+EVENT_ONLINE = "stream.online"
+EVENT_OFFLINE = "stream.offline"
+EVENT_TYPES = frozenset({EVENT_ONLINE, EVENT_OFFLINE})
+
+
+def sign_payload(secret: str, timestamp: str, body: bytes) -> str:
+    """Returns the signature header value for a request body sent at ``timestamp``."""
+    message = timestamp.encode() + b"." + body
+    return "sha256=" + hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_signature(
+    secret: str, timestamp: Optional[str], signature: Optional[str], body: bytes
+) -> bool:
+    if not timestamp or not signature:
+        return False
+    try:
+        sent_at = float(timestamp)
+    except ValueError:
+        return False
+    if abs(time.time() - sent_at) > MAX_TIMESTAMP_SKEW:
+        return False
+    return hmac.compare_digest(sign_payload(secret, timestamp, body), signature)
+
+
+class WebhookReceiver:
+    """Accepts signed go-live and go-offline events over HTTP.
+
+    Events are JSON objects like::
+
+        {"id": "evt_1", "type": "stream.online", "user_id": "usr123", "data": {...}}
+
+    where ``id`` is a string unique to the event, used to drop redeliveries, and
+    ``data`` is the stream's live-status entry, as returned by
+    ``THETA_STREAMS_ENDPOINT``, and may be left out. Requests must carry a
+    ``X-Theta-Timestamp`` header and an ``X-Theta-Signature`` header holding
+    `sign_payload` of the body. Valid events are acknowledged right away and
+    handed to ``handler`` in the background.
+    """
+
+    def __init__(
+        self,
+        secret: str,
+        handler: Callable[[dict], Awaitable[None]],
+        metrics: Optional[ThetaMetrics] = None,
+    ):
+        self.secret = secret
+        self._handler = handler
+        self._metrics = metrics
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._runner: Optional[web.AppRunner] = None
+        self._tasks = set()
+        self.port: Optional[int] = None
+
+    async def start(self, port: int, host: str = "127.0.0.1") -> None:
+        await self.close()
+        app = web.Application(client_max_size=MAX_BODY_SIZE)
+        app.router.add_post(WEBHOOK_PATH, self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+        except OSError:
+            await runner.cleanup()
+            raise
+        self._runner = runner
+        self.port = port
+        log.info("Receiving Theta events on http://%s:%s%s", host, port, WEBHOOK_PATH)
+
+    def _count(self, event_type: str, result: str) -> None:
+        if self._metrics is not None:
+            self._metrics.inc("theta_webhook_events_total", type=event_type, result=result)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if not verify_signature(
+            self.secret,
+            request.headers.get(TIMESTAMP_HEADER),
+            request.headers.get(SIGNATURE_HEADER),
+            body,
+        ):
+            self._count("unknown", "bad_signature")
+            return web.Response(status=401)
+        try:
+            event = json.loads(body)
+        except ValueError:
+            event = None
+        # Type and ID are looked up in sets, so anything but a string is rejected
+        if (
+            not isinstance(event, dict)
+            or not isinstance(event.get("type"), str)
+            or event["type"] not in EVENT_TYPES
+            or not event.get("user_id")
+            or not isinstance(event.get("id"), str)
+            or not event["id"]
+        ):
+            self._count("unknown", "invalid")
+            return web.Response(status=400)
+
+        event_id = event["id"]
+        if event_id in self._seen:
+            self._count(event["type"], "duplicate")
+            return web.Response(status=204)
+        self._seen[event_id] = None
+        if len(self._seen) > SEEN_EVENTS:
+            self._seen.popitem(last=False)
+
+        self._count(event["type"], "accepted")
+        task = asyncio.ensure_future(self._dispatch(event))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response(status=204)
+
+    async def _dispatch(self, event: dict) -> None:
+        try:
+            await self._handler(event)
+        except Exception as error:
+            log.exception("Failed to handle Theta event %r", event.get("id"), exc_info=error)
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+            self.port = None
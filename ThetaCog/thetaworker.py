@@ -0,0 +1,389 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from collections import Counter
+from typing import AsyncIterator, Callable, List, NamedTuple, Optional
+
+import aiohttp
+
+from redbot.core import i18n
+
+from .thetacache import MetadataCache
+from .thetaclient import CIRCUIT_CLOSED, CIRCUIT_OPEN, CircuitBreaker, ThetaClient
+from .thetaerrors import (
+    APIError,
+    InvalidThetaCredentials,
+    OfflineStream,
+    PollWorkerError,
+    StreamNotFound,
+    StreamsError,
+)
+from .thetametrics import ThetaMetrics
+from .thetatypes import ThetaStatusBatcher, ThetaStream, get_headers
+
+log = logging.getLogger("red.core.cogs.Theta")
+
+# Upper bound on how long a single stream check may take, like THETA_POLL_TIMEOUT.
+WORKER_POLL_TIMEOUT = 30
+# How often a side waiting on its queue checks that the other side is still alive.
+WORKER_LIVENESS_INTERVAL = 1
+# How long the worker gets to exit on its own before it is terminated.
+WORKER_STOP_TIMEOUT = 5
+
+
+class StreamJob(NamedTuple):
+    """What the worker needs to know about a stream to check it."""
+
+    index: int
+    name: Optional[str]
+    id: Optional[str]
+    # Ask the API for the user ID, the cog's index entry is missing or stale
+    resolve: bool
+    # Whether the stream was live at its previous check
+    live: bool
+    # Whether alerts are currently posted for the stream
+    alerted: bool
+    posted_state: Optional[tuple]
+
+
+class StreamOutcome(NamedTuple):
+    """A stream check whose result the cog has to act on.
+
+    ``result`` is one of ``live``, ``offline``, ``not_found``, ``timeout`` and
+    ``error``. Live outcomes carry the embed as ``discord.Embed.to_dict()``.
+    """
+
+    index: int
+    result: str
+    name: Optional[str]
+    id: Optional[str]
+    embed: Optional[dict] = None
+    is_rerun: bool = False
+    embed_state: Optional[tuple] = None
+    error: Optional[str] = None
+    # repr() of the error, and whether it is an API failure rather than a bug
+    detail: Optional[str] = None
+    expected: bool = True
+
+
+class PollWorker:
+    """Runs the polling pipeline in a separate process.
+
+    API requests, response decoding, change detection and embed preparation all
+    happen in the worker, which only sends back the outcomes the cog has to act
+    on: streams going live or offline, embeds that changed enough to edit the
+    posted alerts, new names and IDs, and errors. The cog then only does the
+    Discord side of the alerts. The process is started on first use and again
+    if it dies.
+
+    The worker's client has its own circuit breaker, whose transitions are
+    passed to ``on_breaker_change`` and mirrored by `breaker_rejecting`.
+    """
+
+    def __init__(self, on_breaker_change: Optional[Callable[[str, str], None]] = None):
+        self._context = multiprocessing.get_context("spawn")
+        self._process: Optional[multiprocessing.process.BaseProcess] = None
+        self._requests = None
+        self._results = None
+        self._job_ids = itertools.count(1)
+        self._lock = asyncio.Lock()
+        self.restarts = 0
+        self._on_breaker_change = on_breaker_change
+        self.breaker_state = CIRCUIT_CLOSED
+        self._breaker_retry_at = 0.0
+
+    @property
+    def breaker_rejecting(self) -> bool:
+        """Whether the worker's circuit breaker refuses requests, see `CircuitBreaker`."""
+        return self.breaker_state == CIRCUIT_OPEN and time.monotonic() < self._breaker_retry_at
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self._process.pid if self.running else None
+
+    @property
+    def exitcode(self) -> Optional[int]:
+        return self._process.exitcode if self._process is not None else None
+
+    def start(self) -> None:
+        if self.running:
+            return
+        if self._process is not None:
+            self.restarts += 1
+            log.warning("Theta poll worker exited with code %s, restarting it", self.exitcode)
+        self._requests = self._context.Queue()
+        self._results = self._context.Queue()
+        # A new process starts with a closed circuit
+        self.breaker_state = CIRCUIT_CLOSED
+        process = self._context.Process(
+            target=run_worker,
+            args=(self._requests, self._results, i18n.get_locale(), i18n.get_regional_format()),
+            name="theta-poll-worker",
+            daemon=True,
+        )
+        # Red may have loaded the cog from a directory the new interpreter wouldn't search
+        cog_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        added = cog_path not in sys.path
+        if added:
+            sys.path.append(cog_path)
+        try:
+            process.start()
+        finally:
+            if added:
+                sys.path.remove(cog_path)
+        self._process = process
+
+    async def poll(
+        self,
+        client_id: Optional[str],
+        bearer: Optional[str],
+        epoch: Optional[int],
+        concurrency: int,
+        jobs: List[StreamJob],
+        metrics: Optional[ThetaMetrics] = None,
+    ) -> AsyncIterator[StreamOutcome]:
+        """Check the given streams in the worker, yielding outcomes as they come in.
+
+        ``bearer`` is the token kept fresh by the cog's token manager. The worker's
+        API and cache metrics for the cycle are merged into ``metrics``. Raises
+        `PollWorkerError` if the worker dies or fails before finishing.
+        """
+        async with self._lock:
+            self.start()
+            job_id = next(self._job_ids)
+            self._requests.put((job_id, client_id, bearer, epoch, concurrency, jobs))
+            loop = asyncio.get_running_loop()
+            while True:
+                try:
+                    # Blocks a thread rather than the event loop
+                    kind, message_job_id, payload = await loop.run_in_executor(
+                        None, self._results.get, True, WORKER_LIVENESS_INTERVAL
+                    )
+                except queue.Empty:
+                    if not self.running:
+                        raise PollWorkerError(
+                            "The poll worker exited with code {}".format(self.exitcode)
+                        )
+                    continue
+                if kind == "breaker":
+                    # Whichever job it came with, the state is the worker's
+                    self._set_breaker_state(*payload)
+                    continue
+                if message_job_id != job_id:
+                    # Left over from a cycle that was cancelled
+                    continue
+                if kind == "outcome":
+                    yield payload
+                elif kind == "done":
+                    if metrics is not None:
+                        metrics.merge(payload)
+                    return
+                else:
+                    raise PollWorkerError(payload)
+
+    def _set_breaker_state(self, state: str, retry_in: float) -> None:
+        previous, self.breaker_state = self.breaker_state, state
+        self._breaker_retry_at = time.monotonic() + retry_in
+        if previous != state and self._on_breaker_change is not None:
+            self._on_breaker_change(previous, state)
+
+    async def close(self) -> None:
+        process, self._process = self._process, None
+        if process is None:
+            return
+        if process.is_alive():
+            self._requests.put(None)
+            await asyncio.get_running_loop().run_in_executor(
+                None, process.join, WORKER_STOP_TIMEOUT
+            )
+            if process.is_alive():
+                process.terminate()
+        self._requests.close()
+        self._results.close()
+
+
+def run_worker(requests, results, locale: str, regional_format: Optional[str]) -> None:
+    """Entry point of the worker process."""
+    # Embeds are built here, so they must use the bot's language
+    i18n.set_contextual_locale(locale)
+    i18n.set_contextual_regional_format(regional_format)
+    asyncio.run(_WorkerProcess(requests, results).serve())
+
+
+class _WorkerProcess:
+    def __init__(self, requests, results):
+        self._requests = requests
+        self._results = results
+        self._client: Optional[ThetaClient] = None
+        self._cache = MetadataCache()
+        self._batcher: Optional[ThetaStatusBatcher] = None
+        self._cache_hits = Counter()
+        self._cache_misses = Counter()
+        self._breaker = CircuitBreaker(on_change=self._breaker_changed)
+        self._job_id = 0
+
+    def _breaker_changed(self, previous: str, state: str) -> None:
+        self._results.put(("breaker", self._job_id, (state, self._breaker.retry_in)))
+
+    async def serve(self) -> None:
+        # Imported here as the cog module itself imports this one
+        from .theta import Theta
+
+        session = Theta._create_session()
+        self._client = ThetaClient(session, breaker=self._breaker)
+        self._batcher = ThetaStatusBatcher(self._client)
+        loop = asyncio.get_running_loop()
+        parent = multiprocessing.parent_process()
+        try:
+            while True:
+                try:
+                    request = await loop.run_in_executor(
+                        None, self._requests.get, True, WORKER_LIVENESS_INTERVAL
+                    )
+                except queue.Empty:
+                    if parent is not None and not parent.is_alive():
+                        return
+                    continue
+                if request is None:
+                    return
+                job_id = request[0]
+                try:
+                    await self._run_job(*request)
+                except Exception as error:
+                    self._results.put(("error", job_id, repr(error)))
+        finally:
+            await session.close()
+
+    async def _run_job(
+        self,
+        job_id: int,
+        client_id: Optional[str],
+        bearer: Optional[str],
+        epoch: Optional[int],
+        concurrency: int,
+        jobs: List[StreamJob],
+    ) -> None:
+        self._job_id = job_id
+        metrics = ThetaMetrics()
+        self._client.metrics = metrics
+        headers = get_headers(client_id, bearer)
+        statuses = await self._batcher.fetch(
+            headers, [job.id for job in jobs if job.id and not job.resolve]
+        )
+        pending: asyncio.Queue = asyncio.Queue()
+        for job in jobs:
+            pending.put_nowait(job)
+
+        async def check_pending():
+            while True:
+                try:
+                    job = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                outcome = await self._check(
+                    job, statuses.get(job.id), client_id, bearer, epoch
+                )
+                if outcome is not None:
+                    self._results.put(("outcome", job_id, outcome))
+
+        await asyncio.gather(*(check_pending() for _loop_counter in range(concurrency)))
+        self._collect_cache_metrics(metrics)
+        self._results.put(("done", job_id, metrics))
+
+    async def _check(
+        self,
+        job: StreamJob,
+        prefetched: Optional[dict],
+        client_id: Optional[str],
+        bearer: Optional[str],
+        epoch: Optional[int],
+    ) -> Optional[StreamOutcome]:
+        """Check a stream, returns ``None`` when nothing changed since its previous check."""
+        theta = ThetaStream(
+            name=job.name,
+            id=job.id,
+            token=client_id,
+            bearer=bearer,
+            client=self._client,
+            cache=self._cache,
+        )
+        theta._posted_state = job.posted_state
+        try:
+            if job.resolve or not theta.id:
+                try:
+                    theta.id = await theta.fetch_id()
+                except StreamNotFound:
+                    # Renamed, or a display name, the ID it had still identifies the user
+                    if not theta.id:
+                        raise
+            embed, is_rerun = await asyncio.wait_for(
+                theta.is_online(prefetched, epoch), WORKER_POLL_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            return StreamOutcome(job.index, "timeout", theta.name, theta.id)
+        except StreamNotFound:
+            return StreamOutcome(job.index, "not_found", theta.name, theta.id)
+        except OfflineStream:
+            if not job.live and not job.alerted and not self._renamed(job, theta):
+                return None
+            return StreamOutcome(job.index, "offline", theta.name, theta.id)
+        except Exception as error:
+            return StreamOutcome(
+                job.index,
+                "error",
+                theta.name,
+                theta.id,
+                error=type(error).__name__,
+                detail=repr(error),
+                expected=isinstance(
+                    error,
+                    (
+                        APIError,
+                        InvalidThetaCredentials,
+                        StreamsError,
+                        aiohttp.ClientConnectionError,
+                    ),
+                ),
+            )
+
+        if (
+            job.live
+            and job.alerted
+            and job.posted_state is not None
+            and not theta.embed_changed()
+            and not self._renamed(job, theta)
+        ):
+            return None
+        return StreamOutcome(
+            job.index,
+            "live",
+            theta.name,
+            theta.id,
+            embed=embed.to_dict(),
+            is_rerun=is_rerun,
+            embed_state=theta._embed_state,
+        )
+
+    @staticmethod
+    def _renamed(job: StreamJob, theta: ThetaStream) -> bool:
+        return job.resolve or job.name != theta.name or job.id != theta.id
+
+    def _collect_cache_metrics(self, metrics: ThetaMetrics) -> None:
+        """Record what the metadata cache did since the previous cycle."""
+        cache = self._cache
+        for field, count in (cache.hits - self._cache_hits).items():
+            metrics.inc("theta_cache_hits_total", count, field=field)
+        for field, count in (cache.misses - self._cache_misses).items():
+            metrics.inc("theta_cache_misses_total", count, field=field)
+        metrics.set("theta_cache_entries", len(cache))
+        self._cache_hits = Counter(cache.hits)
+        self._cache_misses = Counter(cache.misses)
@@ -0,0 +1,330 @@
+"""Shared fixtures for the ThetaCog benchmarks.
+
+Provides a local stand-in for the Theta API, a minimal fake of the parts of
+`Red` the cog talks to, and helpers to set up Red's Config in a throwaway
+directory. Nothing here touches Discord or the real Theta API.
+"""
+import asyncio
+import copy
+import itertools
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from redbot.core import Config, data_manager  # noqa: E402
+from redbot.core import _drivers as drivers  # noqa: E402
+
+THETA_API_ORIGIN = "https://api.theta.tv"
+BENCH_TOKENS = {"client_id": "bench", "client_secret": "bench", "code_given": "bench"}
+
+
+def git_revision() -> Optional[str]:
+    """Returns the checked out commit, recorded with results to tell runs apart."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def user_id(index: int) -> str:
+    return "usr{:08d}".format(index)
+
+
+def user_name(index: int) -> str:
+    return "bench{}".format(index)
+
+
+class MockThetaAPI:
+    """Serves the Theta API endpoints used by ``thetatypes.py`` on localhost.
+
+    ``latency`` seconds are added to every response and ``error_rate`` of the
+    requests fail with a 503. ``live_ratio`` of the users are live at first;
+    `advance` flips users between live and offline at the ``churn`` rate while
+    keeping that ratio stable on average.
+    """
+
+    def __init__(
+        self,
+        users: int,
+        *,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        live_ratio: float = 0.1,
+        churn: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.live_ratio = live_ratio
+        self.churn = churn
+        self._rng = random.Random(seed)
+        self.live = {user_id(i) for i in range(users) if self._rng.random() < live_ratio}
+        self._users = users
+        self.requests: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self._runner: Optional[web.AppRunner] = None
+        self.origin: Optional[str] = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.origin = "http://127.0.0.1:{}".format(port)
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def advance(self) -> None:
+        """Move to the next poll cycle, flipping some users' live status."""
+        if not self.churn:
+            return
+        # Chosen so that the live ratio stays at live_ratio on average
+        go_live = self.churn * self.live_ratio / max(1 - self.live_ratio, 1e-9)
+        for i in range(self._users):
+            uid = user_id(i)
+            if uid in self.live:
+                if self._rng.random() < self.churn:
+                    self.live.discard(uid)
+            elif self._rng.random() < go_live:
+                self.live.add(uid)
+
+    def reset_counters(self) -> None:
+        self.requests.clear()
+        self.statuses.clear()
+
+    @staticmethod
+    def _endpoint(request: web.Request) -> str:
+        path = request.path
+        if request.method == "POST":
+            return "token"
+        if path.startswith("/v1/theta/live"):
+            return "streams"
+        if path.startswith("/v1/user/"):
+            return "user_id"
+        if path == "/v1/user":
+            return "user"
+        if path.endswith("/channel_action"):
+            return "followers"
+        return "unknown"
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        endpoint = self._endpoint(request)
+        self.requests[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if endpoint != "token" and self._rng.random() < self.error_rate:
+            self.statuses[503] += 1
+            return web.json_response({"message": "unavailable"}, status=503)
+        self.statuses[200] += 1
+        query = request.query
+        if endpoint == "token":
+            body = {"access_token": "bench", "expires_in": 3600}
+        elif endpoint == "streams":
+            body = {
+                "data": [
+                    self._live_entry(uid) for uid in query.getall("user_id", []) if uid in self.live
+                ]
+            }
+        elif endpoint == "user_id":
+            login = query.get("login", "")
+            body = {"data": [{"id": "usr{:08d}".format(int(login[5:]))}]}
+        elif endpoint == "user":
+            index = int(query.get("id", "0")[3:] or 0)
+            body = {
+                "data": [
+                    {
+                        "name": "Game {}".format(index % 50),
+                        "profile_image_url": "https://example.invalid/{}.png".format(index),
+                        "view_count": 1000 + index,
+                    }
+                ]
+            }
+        elif endpoint == "followers":
+            body = {"total": 100 + int(query.get("to_id", "usr0")[3:] or 0) % 1000}
+        else:
+            return web.json_response({"message": "not found"}, status=404)
+        return web.json_response(body)
+
+    @staticmethod
+    def _live_entry(uid: str) -> dict:
+        index = int(uid[3:])
+        return {
+            "user_id": uid,
+            "user_name": user_name(index),
+            "game_id": str(index % 50),
+            "type": "live",
+            "title": "Benchmark stream {}".format(index),
+            "thumbnail_url": "https://example.invalid/{}-{{width}}x{{height}}.jpg".format(index),
+        }
+
+
+class LocalSession:
+    """Wraps a session and sends requests meant for the Theta API to a local origin."""
+
+    def __init__(self, origin: str):
+        self._origin = origin
+        self._session = aiohttp.ClientSession()
+
+    def request(self, method: str, url: str, **kwargs):
+        if url.startswith(THETA_API_ORIGIN):
+            url = self._origin + url[len(THETA_API_ORIGIN) :]
+        return self._session.request(method, url, **kwargs)
+
+    @property
+    def closed(self) -> bool:
+        return self._session.closed
+
+    async def close(self) -> None:
+        await self._session.close()
+
+
+class FakeMessage:
+    __slots__ = ("id", "channel")
+
+    def __init__(self, message_id: int, channel: "FakeChannel"):
+        self.id = message_id
+        self.channel = channel
+
+    async def edit(self, **kwargs) -> None:
+        await self.channel.api_call("edits")
+
+    async def delete(self) -> None:
+        await self.channel.api_call("deletes")
+
+
+class FakeChannel:
+    """A text channel that records what the cog sends to it."""
+
+    _message_ids = itertools.count(1)
+
+    def __init__(self, channel_id: int, guild, stats: Counter, latency: float = 0.0):
+        self.id = channel_id
+        self.guild = guild
+        self._stats = stats
+        self._latency = latency
+
+    async def api_call(self, kind: str) -> None:
+        self._stats[kind] += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+
+    async def send(self, content=None, *, embed=None) -> FakeMessage:
+        await self.api_call("sends")
+        return FakeMessage(next(self._message_ids), self)
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(message_id, self)
+
+
+class FakeBot:
+    """Implements just enough of `Red` for the cog to run its poll cycle."""
+
+    def __init__(self, guilds: int, channels: int, discord_latency: float = 0.0):
+        self.loop = asyncio.get_event_loop()
+        self.discord: Counter = Counter()
+        self.guilds: List[SimpleNamespace] = []
+        for guild_id in range(1, guilds + 1):
+            me = SimpleNamespace(guild_permissions=SimpleNamespace(manage_roles=False))
+            self.guilds.append(
+                SimpleNamespace(id=guild_id, me=me, roles=[], get_role=lambda role_id: None)
+            )
+        self.channels: Dict[int, FakeChannel] = {}
+        for index in range(channels):
+            channel_id = 10_000 + index
+            guild = self.guilds[index % len(self.guilds)]
+            self.channels[channel_id] = FakeChannel(
+                channel_id, guild, self.discord, discord_latency
+            )
+
+    async def wait_until_ready(self) -> None:
+        return None
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channels.get(channel_id)
+
+    async def get_shared_api_tokens(self, service_name: str) -> dict:
+        return dict(BENCH_TOKENS)
+
+    async def set_shared_api_tokens(self, service_name: str, **tokens) -> None:
+        return None
+
+
+async def setup_config() -> str:
+    """Point Red's Config at a JSON store in a new temporary directory."""
+    path = tempfile.mkdtemp(prefix="thetabench-")
+    config = copy.deepcopy(data_manager.basic_config_default)
+    config["DATA_PATH"] = path
+    config["STORAGE_TYPE"] = "JSON"
+    config["STORAGE_DETAILS"] = {}
+    data_manager.basic_config = config
+    await drivers.get_driver_class().initialize(**data_manager.storage_details())
+    return path
+
+
+async def clear_cog_config() -> None:
+    """Wipe whatever a previous run stored for the cog."""
+    await Config.get_conf(None, 26262626, cog_name="Theta").clear_all()
+
+
+async def start_cog(bot: FakeBot, api: MockThetaAPI):
+    """Create the cog against the fake bot and wait for it to finish initializing.
+
+    The cog's own poll loop is stopped so the benchmark can drive cycles itself.
+    """
+    from ThetaCog.theta import Theta
+
+    cog = Theta(bot)
+    cog._create_session = lambda: LocalSession(api.origin)
+    await cog._ready_event.wait()
+    if cog.task is not None:
+        cog.task.cancel()
+    return cog
+
+
+async def stop_cog(cog) -> None:
+    if cog._save_task is not None:
+        cog._save_task.cancel()
+        cog._save_task = None
+    cog._token_manager.close()
+    cog._dispatcher.close()
+    await cog._session.close()
+
+
+def seed_streams(cog, streams: int, channel_ids: List[int]) -> None:
+    """Track ``streams`` benchmark users, each alerting in every given channel.
+
+    Streams carry their user ID, as records saved by older versions do, but the
+    user ID index starts empty, so the first cycle pays for filling it in.
+    """
+    from ThetaCog.thetatypes import ThetaStream
+
+    theta = []
+    for index in range(streams):
+        uid, name = user_id(index), user_name(index)
+        stream = cog._make_theta(
+            ThetaStream,
+            name=name,
+            id=uid,
+            token=BENCH_TOKENS["client_id"],
+            channels=list(channel_ids),
+            _record_key=uid,
+        )
+        theta.append(stream)
+    cog._set_theta(theta)
@@ -0,0 +1,195 @@
+"""Micro-benchmarks of the CPU-bound code that runs on every poll cycle.
+
+Times `ThetaStream.make_embed`, `Theta.export`, `save_theta`, `get_theta`,
+`filter_theta`, alert content formatting and `load_theta` on synthetic streams
+at several scales. Everything runs offline and results are written as JSON::
+
+    python benchmarks/hot_paths.py --scales 100 10000 100000 -o before.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Awaitable, Callable, List
+
+import harness
+
+# Upper bound on the lookups made by a single get_theta run.
+MAX_LOOKUPS = 10000
+
+
+def _result(name: str, scale: int, calls: int, runs: List[float]) -> dict:
+    best = min(runs)
+    return {
+        "name": name,
+        "scale": scale,
+        "calls": calls,
+        "best_seconds": best,
+        "median_seconds": statistics.median(runs),
+        "per_call_us": best / calls * 1e6 if calls else None,
+        "runs": runs,
+    }
+
+
+def _time(fn: Callable[[], object], repeat: int) -> List[float]:
+    runs = []
+    for _run in range(repeat):
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    return runs
+
+
+async def _atime(
+    fn: Callable[[], Awaitable], repeat: int, setup: Callable[[], object] = None
+) -> List[float]:
+    runs = []
+    for _run in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        await fn()
+        runs.append(time.perf_counter() - started)
+    return runs
+
+
+def _live_data(index: int) -> dict:
+    data = harness.MockThetaAPI._live_entry(harness.user_id(index))
+    data.update(
+        game_name="Game {}".format(index % 50),
+        followers=100 + index,
+        view_count=1000 + index,
+        profile_image_url="https://example.invalid/{}.png".format(index),
+    )
+    return data
+
+
+async def run_scale(args, scale: int) -> List[dict]:
+    from ThetaCog.theta import THETA_STREAM_GROUP
+
+    rng = random.Random(args.seed)
+    api = harness.MockThetaAPI(0)
+    await api.start()
+    bot = harness.FakeBot(args.guilds, args.channels)
+    await harness.clear_cog_config()
+    cog = await harness.start_cog(bot, api)
+    results = []
+    try:
+        channel_ids = list(bot.channels)
+        harness.seed_streams(cog, scale, channel_ids)
+        # Give the live share of streams posted alerts so exports carry messages
+        for index, theta in enumerate(cog.theta):
+            if rng.random() < args.live_ratio:
+                theta._messages_cache.extend(
+                    (channel_id, index * len(channel_ids) + n)
+                    for n, channel_id in enumerate(channel_ids)
+                )
+
+        data = [_live_data(index) for index in range(scale)]
+        pairs = list(zip(cog.theta, data))
+        runs = _time(lambda: [theta.make_embed(d, 1) for theta, d in pairs], args.repeat)
+        results.append(_result("make_embed", scale, scale, runs))
+
+        runs = _time(lambda: [theta.export() for theta in cog.theta], args.repeat)
+        results.append(_result("export", scale, scale, runs))
+
+        lookups = min(scale, MAX_LOOKUPS)
+        keys = []
+        for _lookup in range(lookups):
+            index = rng.randrange(scale * 10 // 9 + 1)  # about 10% misses
+            keys.append(
+                harness.user_name(index) if rng.random() < 0.5 else harness.user_id(index)
+            )
+        runs = _time(lambda: [cog.get_theta(None, key) for key in keys], args.repeat)
+        results.append(_result("get_theta", scale, lookups, runs))
+
+        channel = bot.channels[channel_ids[0]]
+        listing = [
+            {"channel": {"_id": harness.user_id(rng.randrange(scale * 2))}} for _i in range(scale)
+        ]
+        runs = await _atime(lambda: cog.filter_theta(listing, channel), args.repeat)
+        results.append(_result("filter_theta", scale, scale, runs))
+
+        settings = dict(cog.guild_defaults)
+        runs = _time(
+            lambda: [cog._make_alert_content(settings, "@everyone", theta) for theta in cog.theta],
+            args.repeat,
+        )
+        results.append(_result("alert_content", scale, scale, runs))
+
+        await cog.db.custom(THETA_STREAM_GROUP).set(
+            {theta._record_key: theta.export() for theta in cog.theta}
+        )
+        runs = await _atime(cog.load_theta, args.repeat)
+        results.append(_result("load_theta", scale, scale, runs))
+
+        for count in sorted({min(count, scale) for count in args.dirty}):
+            dirty = cog.theta[:count]
+            runs = await _atime(
+                cog.save_theta, args.repeat, lambda: cog._dirty_theta.update(dirty)
+            )
+            results.append(_result("save_theta", scale, count, runs))
+    finally:
+        await harness.stop_cog(cog)
+        await api.close()
+    return results
+
+
+async def main(args) -> dict:
+    await harness.setup_config()
+    results = []
+    for scale in args.scales:
+        for result in await run_scale(args, scale):
+            print(
+                "{name:>14} @ {scale:>7} x {calls:>7}: {best:9.4f}s best, "
+                "{per_call:8.2f}us per call".format(
+                    name=result["name"],
+                    scale=scale,
+                    calls=result["calls"],
+                    best=result["best_seconds"],
+                    per_call=result["per_call_us"],
+                ),
+                file=sys.stderr,
+            )
+            results.append(result)
+    return {
+        "benchmark": "hot_paths",
+        "revision": harness.git_revision(),
+        "python": platform.python_version(),
+        "parameters": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[100, 10000, 100000])
+    parser.add_argument("--channels", type=int, default=3, help="alert channels per stream")
+    parser.add_argument("--guilds", type=int, default=3)
+    parser.add_argument("--live-ratio", type=float, default=0.1)
+    parser.add_argument(
+        "--dirty",
+        type=int,
+        nargs="+",
+        default=[5, 500, 100000],
+        help="changed stream records per save_theta run, each count is timed separately",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    report = asyncio.run(main(arguments))
+    if arguments.output:
+        with open(arguments.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,180 @@
+"""End-to-end benchmark of the cog's poll cycle.
+
+Runs `Theta.check_theta` against a local stand-in of the Theta API and fake
+Discord channels, for every combination of stream and channel counts, and
+writes the results as JSON so runs on different versions can be compared::
+
+    python benchmarks/poll_cycle.py --streams 100 1000 --channels 1 10 \\
+        --latency 0.02 --error-rate 0.01 --live-ratio 0.1 -o before.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import List, Optional
+
+import harness
+
+
+def _summarize(samples: List[float]) -> dict:
+    return {
+        "mean": statistics.fmean(samples),
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "max": max(samples),
+    }
+
+
+def _summarize_histogram(histogram) -> Optional[dict]:
+    if histogram is None or not histogram.count:
+        return None
+    return {
+        "count": histogram.count,
+        "mean": histogram.mean,
+        "median": histogram.quantile(0.5),
+        "p95": histogram.quantile(0.95),
+    }
+
+
+async def run_case(args, streams: int, channels: int) -> dict:
+    api = harness.MockThetaAPI(
+        streams,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        live_ratio=args.live_ratio,
+        churn=args.churn,
+        seed=args.seed,
+    )
+    await api.start()
+    bot = harness.FakeBot(args.guilds, channels, args.discord_latency)
+    await harness.clear_cog_config()
+    cog = await harness.start_cog(bot, api)
+    try:
+        await cog.db.poll_concurrency.set(args.concurrency)
+        if args.api_rate:
+            bucket = cog._client.bucket
+            bucket.max_rate = bucket.rate = args.api_rate
+            bucket.capacity = max(bucket.capacity, args.api_rate)
+        for guild in bot.guilds:
+            cog._guild_settings[guild.id] = {
+                **cog.guild_defaults,
+                "autodelete": args.autodelete,
+                "live_updates": args.live_updates,
+            }
+        harness.seed_streams(cog, streams, list(bot.channels))
+        api.reset_counters()
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        cycle_times = []
+        for _cycle in range(args.cycles):
+            started = time.perf_counter()
+            await cog.check_theta()
+            cycle_times.append(time.perf_counter() - started)
+            api.advance()
+        peak_traced = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        if args.tracemalloc:
+            tracemalloc.stop()
+
+        # The debounced save would otherwise run after the measurement, time it on its own
+        if cog._save_task is not None:
+            cog._save_task.cancel()
+            cog._save_task = None
+        started = time.perf_counter()
+        await cog.save_theta()
+        save_time = time.perf_counter() - started
+
+        requests = sum(api.requests.values())
+        checks = streams * args.cycles
+        return {
+            "streams": streams,
+            "channels": channels,
+            "cycle_seconds": _summarize(cycle_times),
+            "cycles": cycle_times,
+            "streams_per_second": checks / sum(cycle_times),
+            "requests": dict(api.requests),
+            "responses": {str(status): count for status, count in api.statuses.items()},
+            "requests_per_stream": requests / checks,
+            "discord": {
+                "sends": bot.discord["sends"],
+                "edits": bot.discord["edits"],
+                "deletes": bot.discord["deletes"],
+            },
+            "alert_latency_seconds": _summarize_histogram(
+                cog._metrics.histogram("theta_alert_delivery_seconds")
+            ),
+            "save_seconds": save_time,
+            "peak_traced_bytes": peak_traced,
+        }
+    finally:
+        await harness.stop_cog(cog)
+        await api.close()
+
+
+async def main(args) -> dict:
+    await harness.setup_config()
+    results = []
+    for streams in args.streams:
+        for channels in args.channels:
+            result = await run_case(args, streams, channels)
+            print(
+                "{streams} streams x {channels} channels: {mean:.3f}s per cycle, "
+                "{rps:.2f} requests per stream, {sends} sends".format(
+                    streams=streams,
+                    channels=channels,
+                    mean=result["cycle_seconds"]["mean"],
+                    rps=result["requests_per_stream"],
+                    sends=result["discord"]["sends"],
+                ),
+                file=sys.stderr,
+            )
+            results.append(result)
+    return {
+        "benchmark": "poll_cycle",
+        "revision": harness.git_revision(),
+        "python": platform.python_version(),
+        "parameters": {
+            key: value for key, value in vars(args).items() if key not in ("output",)
+        },
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--streams", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--channels", type=int, nargs="+", default=[1, 5])
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=10, help="poll_concurrency setting")
+    parser.add_argument(
+        "--api-rate", type=float, help="client request budget per second (cog default if unset)"
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="API latency in seconds")
+    parser.add_argument("--discord-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--live-ratio", type=float, default=0.1)
+    parser.add_argument("--churn", type=float, default=0.1, help="live status flips per cycle")
+    parser.add_argument("--autodelete", action="store_true")
+    parser.add_argument("--live-updates", action="store_true")
+    parser.add_argument("--tracemalloc", action="store_true", help="measure peak Python heap")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    report = asyncio.run(main(arguments))
+    if arguments.output:
+        with open(arguments.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,43 @@
+import asyncio
+
+from ThetaCog.thetatypes import ThetaStatusBatcher
+
+LIVE = {"usr1", "usr3"}
+
+
+class PagedClient:
+    """Lists at most ``page_size`` of the live users asked about in one request."""
+
+    def __init__(self, page_size: int):
+        self.page_size = page_size
+        self.requests = []
+
+    async def get_json(self, url, headers, params):
+        user_ids = [value for key, value in params if key == "user_id"]
+        self.requests.append(user_ids)
+        live = [user_id for user_id in user_ids if user_id in LIVE][: self.page_size]
+        return 200, {"data": [{"user_id": user_id, "user_name": user_id} for user_id in live]}
+
+
+def test_covered_batch_checks_missing_users_individually():
+    client = PagedClient(page_size=100)
+    batcher = ThetaStatusBatcher(client)
+
+    statuses = asyncio.run(batcher.fetch({}, ["usr1", "usr2", "usr3"]))
+
+    assert client.requests == [["usr1", "usr2", "usr3"], ["usr2"]]
+    assert statuses["usr1"]["data"] and statuses["usr3"]["data"]
+    assert statuses["usr2"] == {"data": []}
+    assert batcher.enabled
+
+
+def test_truncated_batch_does_not_report_left_out_users_offline():
+    client = PagedClient(page_size=1)
+    batcher = ThetaStatusBatcher(client)
+
+    statuses = asyncio.run(batcher.fetch({}, ["usr1", "usr2", "usr3"]))
+
+    assert statuses["usr1"]["data"] and statuses["usr3"]["data"]
+    assert statuses["usr2"] == {"data": []}
+    assert not batcher.enabled
+    assert asyncio.run(batcher.fetch({}, ["usr1", "usr2", "usr3"])) == {}
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from ThetaCog.theta import THETA_ID_REVALIDATE_INTERVAL, Theta
+from ThetaCog.thetacache import MetadataCache
+from ThetaCog.thetatypes import THETA_ID_ENDPOINT, ThetaStream
+from ThetaCog.thetaworker import StreamJob, _WorkerProcess
+
+USER_ID = "usr00000042"
+
+
+class RenamedUserClient:
+    """Finds no user with the old login, and the user offline by ID."""
+
+    def __init__(self):
+        self.lookups = []
+
+    async def get_json(self, url, headers, params):
+        self.lookups.append(url)
+        return 200, {"data": []}
+
+
+class UserIdIndex:
+    """The cog's user ID index, without the rest of the cog."""
+
+    _ensure_theta_id = Theta._ensure_theta_id
+    _index_theta_id = Theta._index_theta_id
+    _remember_theta_id = Theta._remember_theta_id
+
+    def __init__(self, resolved_at: float):
+        self._theta_ids = {"oldname": {"id": USER_ID, "resolved_at": resolved_at}}
+        self._changed_theta_ids = set()
+
+
+def test_renamed_user_keeps_indexed_id():
+    cog = UserIdIndex(time.time() - THETA_ID_REVALIDATE_INTERVAL - 1)
+    client = RenamedUserClient()
+    theta = ThetaStream(name="oldname", client=client, cache=MetadataCache())
+
+    asyncio.run(cog._ensure_theta_id(theta))
+
+    assert client.lookups == [THETA_ID_ENDPOINT]
+    assert theta.id == USER_ID
+    assert cog._theta_ids["oldname"]["id"] == USER_ID
+    assert time.time() - cog._theta_ids["oldname"]["resolved_at"] < 60
+    assert cog._changed_theta_ids == {"oldname"}
+
+
+def test_renamed_user_keeps_id_in_poll_worker():
+    worker = _WorkerProcess(None, None)
+    worker._client = RenamedUserClient()
+    job = StreamJob(0, "oldname", USER_ID, True, False, False, None)
+
+    outcome = asyncio.run(worker._check(job, None, None, None, None))
+
+    assert outcome.result == "offline"
+    assert outcome.id == USER_ID
@@ -0,0 +1,87 @@
+"""Send signed go-live and go-offline events to the cog's webhook receiver.
+
+Stands in for Theta when testing `[p]thetaset webhook` locally::
+
+    python tools/theta_event_emitter.py --secret s3cret online usr123 --name somebody
+    python tools/theta_event_emitter.py --secret s3cret offline usr123
+
+Only needs aiohttp, so it can run outside the bot's environment.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import sys
+import time
+import uuid
+
+import aiohttp
+
+DEFAULT_URL = "http://127.0.0.1:8765/theta/events"
+
+
+def sign_payload(secret: str, timestamp: str, body: bytes) -> str:
+    # Must match ThetaCog.thetawebhook.sign_payload
+    message = timestamp.encode() + b"." + body
+    return "sha256=" + hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def build_event(args) -> dict:
+    event = {
+        "id": args.event_id or "evt_" + uuid.uuid4().hex,
+        "type": "stream." + args.type,
+        "user_id": args.user_id,
+    }
+    if args.type == "online" and args.name:
+        event["data"] = {
+            "user_id": args.user_id,
+            "user_name": args.name,
+            "game_id": args.game_id,
+            "type": "live",
+            "title": args.title,
+            "thumbnail_url": args.thumbnail_url,
+        }
+    return event
+
+
+async def send(url: str, secret: str, event: dict, repeat: int) -> int:
+    body = json.dumps(event).encode()
+    status = 0
+    async with aiohttp.ClientSession() as session:
+        for _attempt in range(repeat):
+            timestamp = str(int(time.time()))
+            headers = {
+                "Content-Type": "application/json",
+                "X-Theta-Timestamp": timestamp,
+                "X-Theta-Signature": sign_payload(secret, timestamp, body),
+            }
+            async with session.post(url, data=body, headers=headers) as response:
+                status = response.status
+                print("{} {} -> {}".format(event["type"], event["id"], status), file=sys.stderr)
+    return status
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("type", choices=("online", "offline"))
+    parser.add_argument("user_id", help="Theta user ID of the stream")
+    parser.add_argument("--secret", required=True, help="the bot's theta webhook_secret")
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--name", help="user name, sends the stream entry with the event")
+    parser.add_argument("--title", default="Live from the event emitter")
+    parser.add_argument("--game-id", default="")
+    parser.add_argument(
+        "--thumbnail-url", default="https://example.invalid/thumbnail-{width}x{height}.jpg"
+    )
+    parser.add_argument("--event-id", help="reuse an event ID to test redelivery")
+    parser.add_argument("--repeat", type=int, default=1, help="send the same event N times")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    result = asyncio.run(
+        send(arguments.url, arguments.secret, build_event(arguments), arguments.repeat)
+    )
+    sys.exit(0 if 200 <= result < 300 else 1)